@@ -4,19 +4,21 @@ Premium dark-themed admin interface for MomsVPN management.
 """
 from fastapi import FastAPI, Request, Depends, HTTPException, status
 from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pathlib import Path
 import os
 import secrets
 
+from app.api.services.compression import CompressionMiddleware, PrecompressedStaticFiles
+
 # App setup
 app = FastAPI(
     title="MomsVPN Admin",
     docs_url=None,  # Disable docs in production
     redoc_url=None
 )
+app.add_middleware(CompressionMiddleware)
 
 # HTTP Basic Auth
 security = HTTPBasic()
@@ -44,15 +46,15 @@ BASE_DIR = Path(__file__).parent
 TEMPLATES_DIR = BASE_DIR / "templates"
 STATIC_DIR = BASE_DIR / "static"
 
-# Mount static files (no auth needed for CSS/JS)
-app.mount("/admin/static", StaticFiles(directory=str(STATIC_DIR)), name="admin_static")
+# Mount static files (no auth needed for CSS/JS); compressed once per file version
+app.mount("/admin/static", PrecompressedStaticFiles(directory=str(STATIC_DIR)), name="admin_static")
 
 # Jinja2 templates
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 
 
 # Import routes
-from app.admin.routes import dashboard, users, keys, servers, payments
+from app.admin.routes import dashboard, users, keys, servers, payments, bulk
 
 # Include routers with auth dependency
 app.include_router(dashboard.router, prefix="/admin", dependencies=[Depends(verify_admin)])
@@ -60,6 +62,7 @@ app.include_router(users.router, prefix="/admin", dependencies=[Depends(verify_a
 app.include_router(keys.router, prefix="/admin", dependencies=[Depends(verify_admin)])
 app.include_router(servers.router, prefix="/admin", dependencies=[Depends(verify_admin)])
 app.include_router(payments.router, prefix="/admin", dependencies=[Depends(verify_admin)])
+app.include_router(bulk.router, prefix="/admin", dependencies=[Depends(verify_admin)])
 
 
 @app.get("/admin", response_class=HTMLResponse)
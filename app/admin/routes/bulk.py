@@ -0,0 +1,39 @@
+"""
+Bulk Route - Bulk operations over many VPN keys.
+"""
+from fastapi import APIRouter, Form, HTTPException
+from typing import Optional
+
+from app.admin.services.bulk import BulkOperationService, BULK_CONCURRENCY
+
+router = APIRouter(tags=["bulk"])
+
+
+@router.post("/bulk/{operation}", status_code=202)
+async def start_bulk(
+    operation: str,
+    status: Optional[str] = Form(None),
+    days: Optional[int] = Form(None),
+    concurrency: int = Form(BULK_CONCURRENCY)
+):
+    """Start a bulk operation (extend, reset_traffic, disable, enable) for users with the given status (concurrency 1..20)."""
+    try:
+        job = BulkOperationService.start(operation, status=status, days=days, concurrency=concurrency)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.to_dict()
+
+
+@router.get("/api/bulk")
+async def list_bulk_jobs():
+    """Recent bulk jobs with progress."""
+    return [job.to_dict() for job in BulkOperationService.list_jobs()]
+
+
+@router.get("/api/bulk/{job_id}")
+async def get_bulk_job(job_id: str):
+    """Progress and per-user results of one bulk job."""
+    job = BulkOperationService.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict(with_results=True)
@@ -1,7 +1,7 @@
 """
 Keys Route - VPN key management page.
 """
-from fastapi import APIRouter, Request, Form
+from fastapi import APIRouter, Request, Form, Query
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
@@ -12,13 +12,19 @@ router = APIRouter(tags=["keys"])
 templates = Jinja2Templates(directory=str(Path(__file__).parent.parent / "templates"))
 
 
+KEYS_PER_PAGE = 50
+
+
 @router.get("/keys", response_class=HTMLResponse)
-async def keys_list(request: Request):
-    """List all VPN keys."""
-    keys = await MarzbanAdminService.get_all_users()
+async def keys_list(request: Request, page: int = Query(1, ge=1)):
+    """List VPN keys, one page at a time."""
+    result = await MarzbanAdminService.get_users_page(page=page, per_page=KEYS_PER_PAGE)
     return templates.TemplateResponse("keys.html", {
         "request": request,
-        "keys": keys,
+        "keys": result["users"],
+        "total": result["total"],
+        "page": page,
+        "per_page": KEYS_PER_PAGE,
         "active_page": "keys"
     })
 
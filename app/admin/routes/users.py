@@ -27,6 +27,7 @@ async def users_list(
         "users": users.get("items", []),
         "total": users.get("total", 0),
         "page": page,
+        "per_page": 20,
         "search": search,
         "status": status,
         "active_page": "users"
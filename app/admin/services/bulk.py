@@ -0,0 +1,186 @@
+"""
+Bulk Operations Service - Run one admin action over many Marzban users.
+Bounded concurrency, per-item retries of transient failures and pollable progress.
+"""
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+from dataclasses import dataclass, field
+from datetime import datetime
+import asyncio
+import logging
+import os
+import uuid
+
+import httpx
+
+from app.admin.services.marzban import MarzbanAdminService
+from app.api.services.user_sync import UserMirror, user_sync_service
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for any job, whatever the form asks for: each worker holds a Marzban connection
+BULK_MAX_CONCURRENCY = 20
+BULK_CONCURRENCY = min(max(int(os.getenv("BULK_CONCURRENCY", "10")), 1), BULK_MAX_CONCURRENCY)
+BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "2"))
+BULK_JOBS_KEPT = 20
+
+
+@dataclass
+class BulkJob:
+    """Progress and per-item results of a bulk operation."""
+    id: str
+    operation: str
+    status_filter: Optional[str]
+    days: Optional[int] = None
+    state: str = "pending"  # pending, running, finished, failed
+    total: int = 0
+    done: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    results: Dict[str, str] = field(default_factory=dict)  # username -> "ok" / "failed"
+    error: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    def to_dict(self, with_results: bool = False) -> Dict[str, Any]:
+        data = {
+            "id": self.id,
+            "operation": self.operation,
+            "status_filter": self.status_filter,
+            "days": self.days,
+            "state": self.state,
+            "total": self.total,
+            "done": self.done,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "progress": round(self.done / self.total * 100, 1) if self.total else 0,
+            "failed_users": [u for u, r in self.results.items() if r != "ok"],
+            "error": self.error,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+        if with_results:
+            data["results"] = self.results
+        return data
+
+
+class BulkOperationService:
+    """Service for bulk admin operations on Marzban."""
+
+    OPERATIONS = ("extend", "reset_traffic", "disable", "enable")
+
+    _jobs: Dict[str, BulkJob] = {}
+    _tasks: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _retryable(error: Exception) -> bool:
+        """Network errors and 5xx may succeed on a retry; 4xx and an open circuit will not."""
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code >= 500
+        return isinstance(error, httpx.TransportError)
+
+    @staticmethod
+    async def _succeeded(request: Awaitable[httpx.Response]) -> bool:
+        """True on 200, False on a 4xx."""
+        return (await request).status_code == 200
+
+    @classmethod
+    def _action(cls, job: BulkJob) -> Callable[[str], Awaitable[bool]]:
+        # The mirror is re-synced once at the end instead of per user
+        if job.operation == "extend":
+            # Never raises, so never retried: a failed write may already have added the days
+            return lambda u: MarzbanAdminService.extend_user(u, job.days, refresh_mirror=False)
+        # These raise on 5xx and network errors so run_one can retry them
+        if job.operation == "reset_traffic":
+            return lambda u: cls._succeeded(MarzbanAdminService.reset_traffic(u))
+        status = "disabled" if job.operation == "disable" else "active"
+        return lambda u: cls._succeeded(MarzbanAdminService.set_status(u, status))
+
+    @staticmethod
+    async def _target_usernames(status: Optional[str]) -> List[str]:
+        """Usernames matching the status filter (all users if None)."""
+        usernames = []
+        offset, page_size = 0, 500
+        while True:
+            page = await UserMirror.get_users_page(offset, page_size, status=status)
+            if page.get("error"):
+                raise RuntimeError("Failed to list users from Marzban")
+            usernames.extend(u["username"] for u in page["users"])
+            offset += len(page["users"])
+            if not page["users"] or offset >= page["total"]:
+                return usernames
+
+    @classmethod
+    def start(cls, operation: str, status: Optional[str] = None, days: Optional[int] = None,
+              concurrency: int = BULK_CONCURRENCY, retries: int = BULK_MAX_RETRIES) -> BulkJob:
+        """Create a job and run it in the background."""
+        if operation not in cls.OPERATIONS:
+            raise ValueError(f"Unknown bulk operation: {operation}")
+        if operation == "extend" and not days:
+            raise ValueError("extend requires a positive number of days")
+
+        job = BulkJob(id=uuid.uuid4().hex[:12], operation=operation, status_filter=status or None, days=days)
+        cls._jobs[job.id] = job
+        # Keep only the most recent jobs in memory
+        for old_id in list(cls._jobs)[:-BULK_JOBS_KEPT]:
+            if cls._jobs[old_id].state in ("finished", "failed"):
+                cls._jobs.pop(old_id, None)
+
+        concurrency = min(max(concurrency, 1), BULK_MAX_CONCURRENCY)
+        task = asyncio.get_running_loop().create_task(cls._run(job, concurrency, max(0, retries)))
+        cls._tasks[job.id] = task
+        task.add_done_callback(lambda _: cls._tasks.pop(job.id, None))
+        return job
+
+    @classmethod
+    async def _run(cls, job: BulkJob, concurrency: int, retries: int):
+        job.state = "running"
+        job.started_at = datetime.now()
+        try:
+            usernames = await cls._target_usernames(job.status_filter)
+            job.total = len(usernames)
+            logger.info(f"Bulk {job.operation} ({job.id}) started for {job.total} users")
+
+            action = cls._action(job)
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def run_one(username: str):
+                async with semaphore:
+                    ok = False
+                    for attempt in range(retries + 1):
+                        try:
+                            ok = await action(username)
+                            break
+                        except Exception as e:
+                            if not cls._retryable(e) or attempt == retries:
+                                logger.error(f"Bulk {job.operation} failed for {username}: {e}")
+                                break
+                        await asyncio.sleep(0.5 * (2 ** attempt))
+                job.results[username] = "ok" if ok else "failed"
+                job.done += 1
+                if ok:
+                    job.succeeded += 1
+                else:
+                    job.failed += 1
+
+            await asyncio.gather(*(run_one(u) for u in usernames))
+            job.state = "finished"
+        except Exception as e:
+            logger.error(f"Bulk {job.operation} ({job.id}) failed: {e}")
+            job.state = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now()
+
+        logger.info(f"Bulk {job.operation} ({job.id}) {job.state}: {job.succeeded} ok, {job.failed} failed")
+        try:
+            await user_sync_service.sync_once()
+        except Exception as e:
+            logger.error(f"Mirror sync after bulk job failed: {e}")
+
+    @classmethod
+    def get_job(cls, job_id: str) -> Optional[BulkJob]:
+        return cls._jobs.get(job_id)
+
+    @classmethod
+    def list_jobs(cls) -> List[BulkJob]:
+        return list(reversed(list(cls._jobs.values())))
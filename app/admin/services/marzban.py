@@ -3,9 +3,13 @@ Marzban Admin Service - Admin operations for Marzban.
 """
 from typing import Optional, Dict, Any, List
 import httpx
-import os
 import logging
-from datetime import datetime, timedelta
+
+from app.api.services.mutations import mutation_service
+from app.api.services.nodes import node_registry
+from app.api.services.status_poller import status_poller
+from app.api.services.user_sync import UserMirror, user_sync_service
+from app.api.services.xray import ADMIN_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
@@ -13,140 +17,107 @@ logger = logging.getLogger(__name__)
 class MarzbanAdminService:
     """Service for admin operations on Marzban."""
     
-    _token: Optional[str] = None
-    _base_url = os.getenv("MARZBAN_URL", "https://instabotwebhook.ru:8000")
-    
-    @classmethod
-    async def _get_token(cls) -> str:
-        """Get or refresh admin token."""
-        if cls._token:
-            return cls._token
-            
-        async with httpx.AsyncClient(verify=os.getenv("MARZBAN_VERIFY_SSL", "true").lower() != "false", timeout=30) as client:
-            resp = await client.post(
-                f"{cls._base_url}/api/admin/token",
-                data={
-                    "username": os.getenv("MARZBAN_USERNAME"),
-                    "password": os.getenv("MARZBAN_PASSWORD")
-                }
-            )
-            cls._token = resp.json().get("access_token")
-            return cls._token
-    
     @classmethod
-    async def _get_headers(cls) -> Dict[str, str]:
-        """Get auth headers."""
-        token = await cls._get_token()
-        return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    async def _request(cls, username: str, method: str, path: str, **kwargs) -> httpx.Response:
+        """Authorized request to the user's node (pooled client, 401 retry, circuit breaker)."""
+        service = await node_registry.service_for(username)
+        kwargs.setdefault("timeout", ADMIN_TIMEOUT)
+        try:
+            return await service._request(method, path, **kwargs)
+        finally:
+            service.invalidate_user(username)
     
     @classmethod
     async def get_all_users(cls) -> List[Dict[str, Any]]:
         """Get all users from Marzban."""
-        try:
-            headers = await cls._get_headers()
-            async with httpx.AsyncClient(verify=os.getenv("MARZBAN_VERIFY_SSL", "true").lower() != "false", timeout=30) as client:
-                resp = await client.get(f"{cls._base_url}/api/users", headers=headers)
-                data = resp.json()
-                return data.get("users", [])
-        except Exception as e:
-            logger.error(f"Error getting users: {e}")
-            return []
+        # Every node; each shares its in-flight /api/users request with the dashboard and bot
+        return await node_registry.get_all_users()
+    
+    @classmethod
+    async def get_users_page(cls, page: int = 1, per_page: int = 50, status: Optional[str] = None, search: Optional[str] = None) -> Dict[str, Any]:
+        """Get one page of users from the local mirror."""
+        return await UserMirror.get_users_page((page - 1) * per_page, per_page, status, search)
     
     @classmethod
     async def get_system_status(cls) -> Dict[str, Any]:
-        """Get Marzban system status."""
-        try:
-            headers = await cls._get_headers()
-            async with httpx.AsyncClient(verify=os.getenv("MARZBAN_VERIFY_SSL", "true").lower() != "false", timeout=30) as client:
-                resp = await client.get(f"{cls._base_url}/api/system", headers=headers)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    return {
-                        "online": True,
-                        "version": data.get("version", "Unknown"),
-                        "online_users": data.get("users_active", 0),
-                        "total_users": data.get("total_user", 0),
-                        "cpu_usage": round(data.get("cpu_usage", 0), 1),
-                        "mem_used": data.get("mem_used", 0),
-                        "mem_total": data.get("mem_total", 0),
-                        "uptime": data.get("uptime", 0)
-                    }
-        except Exception as e:
-            logger.error(f"Error getting system status: {e}")
+        """Get Marzban system status from the shared poller snapshot."""
+        snapshot = await status_poller.snapshot()
+        data = snapshot.system
+        if data is not None:
+            return {
+                "online": True,
+                "version": data.get("version", "Unknown"),
+                "online_users": data.get("users_active", 0),
+                "total_users": data.get("total_user", 0),
+                "cpu_usage": round(data.get("cpu_usage", 0), 1),
+                "mem_used": data.get("mem_used", 0),
+                "mem_total": data.get("mem_total", 0),
+                "uptime": data.get("uptime", 0),
+                "age": round(snapshot.age, 1)
+            }
         
-        return {"online": False}
+        return {"online": False, "age": round(snapshot.age, 1)}
+    
+    @classmethod
+    async def set_status(cls, username: str, status: str) -> httpx.Response:
+        """Set a user's status ("active" / "disabled"); raises on 5xx and network errors."""
+        resp = await cls._request(username, "PUT", f"/api/user/{username}", json={"status": status})
+        if resp.status_code >= 500:
+            resp.raise_for_status()
+        return resp
+    
+    @classmethod
+    async def reset_traffic(cls, username: str) -> httpx.Response:
+        """Reset a user's traffic usage; raises on 5xx and network errors."""
+        resp = await cls._request(username, "POST", f"/api/user/{username}/reset")
+        if resp.status_code >= 500:
+            resp.raise_for_status()
+        return resp
     
     @classmethod
-    async def disable_user(cls, username: str) -> bool:
+    async def disable_user(cls, username: str, refresh_mirror: bool = True) -> bool:
         """Disable a user."""
         try:
-            headers = await cls._get_headers()
-            async with httpx.AsyncClient(verify=os.getenv("MARZBAN_VERIFY_SSL", "true").lower() != "false", timeout=30) as client:
-                resp = await client.put(
-                    f"{cls._base_url}/api/user/{username}",
-                    headers=headers,
-                    json={"status": "disabled"}
-                )
-                return resp.status_code == 200
+            resp = await cls.set_status(username, "disabled")
+            if resp.status_code == 200 and refresh_mirror:
+                await user_sync_service.refresh_user(username)
+            return resp.status_code == 200
         except Exception as e:
             logger.error(f"Error disabling user: {e}")
             return False
     
     @classmethod
-    async def enable_user(cls, username: str) -> bool:
+    async def enable_user(cls, username: str, refresh_mirror: bool = True) -> bool:
         """Enable a user."""
         try:
-            headers = await cls._get_headers()
-            async with httpx.AsyncClient(verify=os.getenv("MARZBAN_VERIFY_SSL", "true").lower() != "false", timeout=30) as client:
-                resp = await client.put(
-                    f"{cls._base_url}/api/user/{username}",
-                    headers=headers,
-                    json={"status": "active"}
-                )
-                return resp.status_code == 200
+            resp = await cls.set_status(username, "active")
+            if resp.status_code == 200 and refresh_mirror:
+                await user_sync_service.refresh_user(username)
+            return resp.status_code == 200
         except Exception as e:
             logger.error(f"Error enabling user: {e}")
             return False
     
     @classmethod
-    async def reset_user_traffic(cls, username: str) -> bool:
+    async def reset_user_traffic(cls, username: str, refresh_mirror: bool = True) -> bool:
         """Reset user's traffic usage."""
         try:
-            headers = await cls._get_headers()
-            async with httpx.AsyncClient(verify=os.getenv("MARZBAN_VERIFY_SSL", "true").lower() != "false", timeout=30) as client:
-                resp = await client.post(
-                    f"{cls._base_url}/api/user/{username}/reset",
-                    headers=headers
-                )
-                return resp.status_code == 200
+            resp = await cls.reset_traffic(username)
+            if resp.status_code == 200 and refresh_mirror:
+                await user_sync_service.refresh_user(username)
+            return resp.status_code == 200
         except Exception as e:
             logger.error(f"Error resetting traffic: {e}")
             return False
     
     @classmethod
-    async def extend_user(cls, username: str, days: int) -> bool:
-        """Extend user's subscription."""
+    async def extend_user(cls, username: str, days: int, refresh_mirror: bool = True) -> bool:
+        """Extend user's subscription (serialised and coalesced per user)."""
         try:
-            headers = await cls._get_headers()
-            # Get current expiry
-            async with httpx.AsyncClient(verify=os.getenv("MARZBAN_VERIFY_SSL", "true").lower() != "false", timeout=30) as client:
-                user_resp = await client.get(f"{cls._base_url}/api/user/{username}", headers=headers)
-                user = user_resp.json()
-                
-                current_expire = user.get("expire", 0)
-                if current_expire == 0:
-                    # No expiry set, set from now
-                    new_expire = int((datetime.now() + timedelta(days=days)).timestamp())
-                else:
-                    # Extend from current expiry
-                    new_expire = current_expire + (days * 86400)
-                
-                resp = await client.put(
-                    f"{cls._base_url}/api/user/{username}",
-                    headers=headers,
-                    json={"expire": new_expire}
-                )
-                return resp.status_code == 200
+            ok = await mutation_service.extend(username, days)
+            if ok and refresh_mirror:
+                await user_sync_service.refresh_user(username)
+            return ok
         except Exception as e:
             logger.error(f"Error extending user: {e}")
             return False
@@ -5,7 +5,9 @@ from typing import Optional, Dict, Any, List
 from sqlalchemy import select, func
 from datetime import datetime, timedelta
 
-from app.api.services.xray import marzban_service
+from app.api.services.user_sync import UserMirror
+from app.api.services.status_poller import status_poller
+from app.api.services.nodes import node_registry
 
 
 class StatsService:
@@ -15,18 +17,16 @@ class StatsService:
     async def get_overview() -> Dict[str, Any]:
         """Get dashboard overview statistics."""
         try:
-            # Get all users from Marzban
-            users = await marzban_service.get_all_users()
-            
-            total_users = len(users) if users else 0
-            active_users = sum(1 for u in users if u.get("status") == "active") if users else 0
+            # Counts and traffic come from the local user mirror
+            total_users = await UserMirror.count_users()
+            active_users = await UserMirror.count_users(status="active")
             
             # Calculate total traffic
-            total_traffic = sum(u.get("used_traffic", 0) for u in users) if users else 0
+            total_traffic = await UserMirror.total_traffic()
             total_traffic_gb = round(total_traffic / (1024**3), 2)
             
-            # Get server status
-            server = await marzban_service.get_server_status()
+            # Get server status from the shared poller snapshot
+            server = (await status_poller.snapshot()).server_status()
             
             return {
                 "total_users": total_users,
@@ -49,26 +49,18 @@ class StatsService:
     async def get_users(search: Optional[str] = None, status: Optional[str] = None, page: int = 1) -> Dict[str, Any]:
         """Get paginated list of users."""
         try:
-            users = await marzban_service.get_all_users()
-            if not users:
-                return {"items": [], "total": 0}
-            
-            # Filter by search
-            if search:
-                users = [u for u in users if search.lower() in u.get("username", "").lower()]
-            
-            # Filter by status
-            if status:
-                users = [u for u in users if u.get("status") == status]
-            
-            # Pagination
+            # Filtering and pagination are local DB queries
             per_page = 20
-            start = (page - 1) * per_page
-            end = start + per_page
+            result = await UserMirror.get_users_page(
+                offset=(page - 1) * per_page,
+                limit=per_page,
+                status=status,
+                search=search
+            )
             
             return {
-                "items": users[start:end],
-                "total": len(users)
+                "items": result["users"],
+                "total": result["total"]
             }
         except Exception:
             return {"items": [], "total": 0}
@@ -78,7 +70,8 @@ class StatsService:
         """Get detailed user information."""
         try:
             username = f"user_{telegram_id}"
-            return await marzban_service.get_user(username)
+            service = await node_registry.service_for(username)
+            return await service.get_user(username)
         except Exception:
             return None
     
@@ -1,6 +1,12 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import Any, Dict
 import os
+import time
+
+from app.api.services.metrics import metrics
 
 # Use SQLite by default for local dev if config is missing, else Postgres
 DB_USER = os.getenv('POSTGRES_USER')
@@ -9,12 +15,92 @@ if DB_USER:
 else:
     DATABASE_URL = "sqlite+aiosqlite:///./local_dev.db"
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that times checkouts, including waiting for a free connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        error = True
+        try:
+            connection = super()._do_get()
+            error = False
+            return connection
+        finally:
+            metrics.observe("db", "pool checkout", time.perf_counter() - start, error)
+
+
+SQLITE_SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+def _sqlite_synchronous() -> str:
+    # Interpolated into a PRAGMA, so only the documented modes are accepted
+    mode = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper()
+    if mode not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError(f"SQLITE_SYNCHRONOUS must be one of {', '.join(SQLITE_SYNCHRONOUS_MODES)}, got {mode!r}")
+    return mode
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer; NORMAL fsyncs only at checkpoints under WAL
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={_sqlite_synchronous()}")
+    # Negative = KiB rather than pages
+    cursor.execute(f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_KB', '65536'))}")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def create_engine_from_env(url: str = DATABASE_URL) -> AsyncEngine:
+    """Engine with pool settings from DB_* env (SQLite pragmas / asyncpg statement cache as applicable)."""
+    sqlite = url.startswith("sqlite")
+    options: Dict[str, Any] = {
+        "poolclass": InstrumentedPool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE") or (5 if sqlite else 10)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW") or (5 if sqlite else 20)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() != "false",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+    if url.startswith("postgresql+asyncpg"):
+        # Set to 0 behind pgbouncer in transaction mode (prepared statements don't survive there)
+        cache_size = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+        options["connect_args"] = {"statement_cache_size": cache_size}
+        url += f"?prepared_statement_cache_size={cache_size}"
+
+    # SQL logging is switched on via SQL_ECHO in logging_setup, through the shared log queue
+    new_engine = create_async_engine(url, **options)
+    if sqlite:
+        _sqlite_synchronous()  # fail at startup rather than on the first connection
+        event.listen(new_engine.sync_engine, "connect", _sqlite_pragmas)
+    return new_engine
+
+
+def pool_status() -> Dict[str, Any]:
+    pool = engine.sync_engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow()
+    }
+
+
+engine = create_engine_from_env()
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
+metrics.gauge("db_pool_checked_out", "Database connections currently checked out.",
+              lambda: engine.sync_engine.pool.checkedout())
+metrics.gauge("db_pool_overflow", "Database connections open beyond pool_size (negative = unopened pool slots).",
+              lambda: engine.sync_engine.pool.overflow())
+
 class Base(DeclarativeBase):
     pass
 
 async def get_db():
-    async with async_session_maker() as session:
-        yield session
+    # Session lifetime per request; in-flight = sessions currently open
+    with metrics.track("db", "session"):
+        async with async_session_maker() as session:
+            yield session
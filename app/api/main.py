@@ -9,23 +9,70 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# gzip/brotli for complete responses; /sub documents and admin static files bring cached variants
+from app.api.services.compression import CompressionMiddleware
+app.add_middleware(CompressionMiddleware)
+
 @app.on_event("startup")
 async def startup():
+    # Log records are written by a background thread, off the event loop
+    from app.api.services.logging_setup import setup_logging
+    setup_logging()
+
     # Only for dev: create tables on startup
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+    # Keep the local Marzban user mirror fresh for admin views
+    from app.api.services.user_sync import user_sync_service
+    user_sync_service.start()
+
+    # One /api/system poll per process; status readers use its snapshot
+    from app.api.services.status_poller import status_poller
+    status_poller.start()
+
+    # Keep-alive pool for the /sub proxy
+    from app.api.services.subscription_proxy import sub_proxy
+    await sub_proxy.start()
+
+    # Token -> user index for /sub requests
+    from app.api.services.token_index import token_index
+    await token_index.load()
+
+    # Write-behind device recording for /sub requests
+    from app.api.services.device_tracker import device_tracker
+    device_tracker.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    from app.api.services.nodes import node_registry
+    from app.api.services.status_poller import status_poller
+    from app.api.services.user_sync import user_sync_service
+    from app.api.services.subscription_proxy import sub_proxy
+    from app.api.services.device_tracker import device_tracker
+    await device_tracker.stop()
+    await status_poller.stop()
+    await user_sync_service.stop()
+    await sub_proxy.close()
+    await node_registry.close()
+    from app.api.services.logging_setup import stop_logging
+    stop_logging()
+
 @app.get("/")
 async def root():
     return {"status": "ok", "service": "VPN SaaS Core API"}
 
-from app.api.routers import users, billing, subscription
-from app.api.routers.users import server_router
+from app.api.routers import users, billing, subscription, metrics
+from app.api.routers.users import server_router, ops_router
+from app.admin.main import verify_admin
+from fastapi import Depends
 
 app.include_router(users.router)
 app.include_router(billing.router)
 app.include_router(subscription.router)
 app.include_router(server_router)
+app.include_router(ops_router, dependencies=[Depends(verify_admin)])
+app.include_router(metrics.router)
 
 # Mount Admin Panel
 from app.admin.main import app as admin_app
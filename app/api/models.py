@@ -91,3 +91,19 @@ class Device(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("User")
+
+
+class MarzbanUser(Base):
+    """Local mirror of Marzban users, kept fresh by the background sync."""
+    __tablename__ = "marzban_users"
+
+    username = Column(String, primary_key=True)  # Marzban username (user_<tg_id>)
+    status = Column(String, index=True)
+    used_traffic = Column(BigInteger, default=0, index=True)
+    data_limit = Column(BigInteger, nullable=True)
+    expire = Column(BigInteger, nullable=True, index=True)
+    online_at = Column(String, nullable=True)    # ISO timestamp as returned by Marzban
+    note = Column(Text, nullable=True)
+    sub_last_user_agent = Column(Text, nullable=True)
+    created_at = Column(String, nullable=True, index=True)  # Marzban's created_at, keeps its list order
+    synced_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+
+from app.api.services.metrics import metrics, CONTENT_TYPE
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics")
+async def get_metrics():
+    """Upstream latency histograms, error counters and in-flight gauges (Prometheus text format)"""
+    return Response(content=metrics.render(), headers={"Content-Type": CONTENT_TYPE})
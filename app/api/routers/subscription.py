@@ -4,87 +4,55 @@ Intercepts subscription requests from VPN clients (Happ),
 logs device info, and proxies to Marzban.
 """
 from fastapi import APIRouter, Request, Response
-from fastapi.responses import PlainTextResponse
-import httpx
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import logging
-import re
-import os
+
+from app.api.services.circuit_breaker import CircuitOpenError
+from app.api.services.compression import MIN_SIZE, negotiate
+from app.api.services.device_tracker import device_tracker
+from app.api.services.logging_setup import log_event
+from app.api.services.rate_limit import sub_rate_limiter
+from app.api.services.sub_renderer import sub_renderer
+from app.api.services.subscription_proxy import SubscriptionDocument, SubscriptionStream, sub_proxy
+from app.api.services.user_agent import parse_user_agent
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/sub", tags=["subscription"])
 
-MARZBAN_URL = os.getenv("MARZBAN_URL", "https://instabotwebhook.ru:8000")
-
 
 def parse_device_from_headers(headers: dict) -> dict:
-    """Parse device info from HTTP headers."""
-    user_agent = headers.get("user-agent", "")
-    
-    device_info = {
-        "user_agent": user_agent,
-        "device_name": None,
-        "os_version": None,
-        "app_name": None,
-        "app_version": None
-    }
-    
-    if not user_agent:
-        return device_info
-    
-    ua_lower = user_agent.lower()
-    
-    # Parse Happ: "Happ/3.7.0/ios CFNetwork/3860.300.31 Darwin/25.2.0"
-    # Or other clients
-    
-    # Extract app name and version
-    app_match = re.match(r'^(\w+)/([0-9.]+)', user_agent)
-    if app_match:
-        device_info["app_name"] = app_match.group(1)
-        device_info["app_version"] = app_match.group(2)
-    
-    # Darwin version to iOS version mapping (approximate)
-    darwin_to_ios = {
-        "25.": "18.",  # iOS 18.x
-        "24.": "17.",  # iOS 17.x
-        "23.": "16.",  # iOS 16.x
-        "22.": "15.",  # iOS 15.x
-        "21.": "14.",  # iOS 14.x
-    }
-    
-    darwin_match = re.search(r'darwin/(\d+)\.(\d+)', ua_lower)
-    if darwin_match:
-        major = darwin_match.group(1)
-        minor = darwin_match.group(2)
-        for darwin_prefix, ios_prefix in darwin_to_ios.items():
-            if major + "." == darwin_prefix:
-                # Convert Darwin minor to approximate iOS minor
-                ios_minor = int(minor) // 100 if int(minor) > 10 else minor
-                device_info["os_version"] = f"iOS {ios_prefix}{ios_minor}"
-                break
-    
-    # Detect device type
-    if "iphone" in ua_lower or "/ios" in ua_lower:
-        device_info["device_name"] = "iPhone"
-    elif "ipad" in ua_lower:
-        device_info["device_name"] = "iPad"
-    elif "android" in ua_lower:
-        device_info["device_name"] = "Android"
-        # Try to extract Android version
-        android_match = re.search(r'android[/\s]*([\d.]+)', ua_lower)
-        if android_match:
-            device_info["os_version"] = f"Android {android_match.group(1)}"
-    elif "windows" in ua_lower:
-        device_info["device_name"] = "Windows PC"
-        device_info["os_version"] = "Windows"
-    elif "mac" in ua_lower:
-        device_info["device_name"] = "Mac"
-        device_info["os_version"] = "macOS"
-    
-    # Log full headers for debugging
-    logger.info(f"Device parsed: {device_info}")
-    
-    return device_info
+    """Parse device info from HTTP headers (memoized per User-Agent)."""
+    return parse_user_agent(headers.get("user-agent", "")).device_dict()
+
+
+def document_response(document: SubscriptionDocument, request: Request) -> Response:
+    """Full response (compressed variant if the client accepts one), or 304 when its validators still match."""
+    if document.status_code == 200 and document.not_modified(
+        request.headers.get("if-none-match"), request.headers.get("if-modified-since")
+    ):
+        return Response(status_code=304, headers={
+            k: v for k, v in document.response_headers().items() if k in ("ETag", "Last-Modified")
+        })
+
+    body = document.body
+    headers = document.response_headers()
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    if document.status_code == 200 and encoding and len(body) >= MIN_SIZE:
+        body = document.encoded(encoding)
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+        if "ETag" in headers:
+            # Same content, different bytes: weak validator (If-None-Match compares weakly)
+            headers["ETag"] = "W/" + headers["ETag"].removeprefix("W/")
+
+    return Response(
+        content=body,
+        status_code=document.status_code,
+        headers=headers,
+        media_type=document.headers.get("content-type", "text/plain")
+    )
 
 
 @router.get("/{token}")
@@ -92,37 +60,62 @@ async def subscription_proxy(token: str, request: Request):
     """
     Proxy subscription requests to Marzban while capturing device info.
     """
-    # Get client IP
-    client_ip = request.client.host if request.client else "unknown"
+    # Client IP (the forwarded one when the peer is a trusted reverse proxy)
+    client_ip = sub_rate_limiter.client_ip(
+        request.client.host if request.client else None, request.headers.get("x-forwarded-for")
+    )
     
     # Parse device info from headers
     headers_dict = dict(request.headers)
-    device_info = parse_device_from_headers(headers_dict)
+    ua_info = parse_user_agent(headers_dict.get("user-agent", ""))
+    device_info = ua_info.device_dict()
     
-    # Log for debugging
-    logger.info(f"Subscription request for token: {token[:20]}...")
-    logger.info(f"Client IP: {client_ip}")
-    logger.info(f"User-Agent: {device_info['user_agent']}")
-    logger.info(f"Parsed device: {device_info['device_name']} / {device_info['os_version']}")
+    log_event(
+        logger, logging.DEBUG, "sub request", token=token[:20], ip=client_ip,
+        device=device_info["device_name"], os=device_info["os_version"], ua=device_info["user_agent"]
+    )
     
-    # TODO: Save device info to database (link token to user)
-    # This requires decoding the token to get username
+    # Over the per-token / per-IP limit: the cached copy if there is one, else 429
+    retry_after = sub_rate_limiter.check(token, client_ip)
+    if retry_after:
+        cached = sub_proxy.peek(token, headers_dict.get("user-agent", ""))
+        if cached is not None:
+            return document_response(cached, request)
+        log_event(logger, logging.INFO, "sub rate limited", token=token[:20], ip=client_ip)
+        return PlainTextResponse(
+            content="Too many requests",
+            status_code=429,
+            headers={"Retry-After": str(int(min(retry_after, 3600)) + 1)}
+        )
     
-    # Proxy request to Marzban
+    # Serve from the document cache; on a miss stream Marzban's bytes straight through
     try:
-        async with httpx.AsyncClient(verify=os.getenv("MARZBAN_VERIFY_SSL", "true").lower() != "false", timeout=30) as client:
-            marzban_url = f"{MARZBAN_URL}/sub/{token}"
-            response = await client.get(marzban_url, headers={
-                "User-Agent": headers_dict.get("user-agent", "")
-            })
-            
-            return PlainTextResponse(
-                content=response.text,
-                status_code=response.status_code,
-                headers={
-                    "Content-Type": response.headers.get("Content-Type", "text/plain")
-                }
+        # Rendered from local links and usage when enabled and the user qualifies
+        result = await sub_renderer.render(token, headers_dict.get("user-agent", ""))
+        if result is None:
+            result = await sub_proxy.get(token, headers_dict.get("user-agent", ""))
+        
+        # Only polls that were served a subscription count as devices (unindexed tokens are
+        # dropped by the tracker); buffered and written off the request path
+        if result.status_code == 200:
+            device_tracker.record(token, ua_info, None if client_ip == "unknown" else client_ip)
+        
+        if isinstance(result, SubscriptionStream):
+            return StreamingResponse(
+                result.iter_bytes(),
+                status_code=result.status_code,
+                headers=result.headers,
+                background=BackgroundTask(result.aclose)
             )
+        
+        return document_response(result, request)
+    except CircuitOpenError as e:
+        log_event(logger, logging.WARNING, "sub upstream circuit open", retry_after=round(e.retry_after, 1))
+        return PlainTextResponse(
+            content="Service temporarily unavailable",
+            status_code=503,
+            headers={"Retry-After": str(int(e.retry_after) + 1)}
+        )
     except Exception as e:
-        logger.error(f"Error proxying to Marzban: {e}")
+        log_event(logger, logging.ERROR, "sub proxy error", token=token[:20], error=e)
         return PlainTextResponse(content="Error", status_code=500)
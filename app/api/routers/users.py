@@ -33,9 +33,103 @@ async def get_user_subscription(telegram_id: int, db: AsyncSession = Depends(get
 from app.api.services.xray import marzban_service
 
 server_router = APIRouter(prefix="/server", tags=["server"])
+# Diagnostics (caches, nodes, tokens, devices...): main.py includes this one behind admin auth
+ops_router = APIRouter(prefix="/server", tags=["server"])
 
 @server_router.get("/status")
 async def get_server_status():
-    """Get Marzban server health status"""
-    status = await marzban_service.get_server_status()
-    return status
+    """Get Marzban server health status (latest poller snapshot)"""
+    from app.api.services.status_poller import status_poller
+    return (await status_poller.snapshot()).server_status()
+
+
+@ops_router.get("/cache")
+async def get_cache_stats():
+    """Marzban user cache hit/miss counters"""
+    return marzban_service.cache_stats()
+
+
+@ops_router.get("/breaker")
+async def get_breaker_stats():
+    """Marzban circuit breaker state"""
+    return marzban_service.breaker_stats()
+
+
+@ops_router.get("/nodes")
+async def get_nodes():
+    """Registered Marzban nodes with their circuit state"""
+    from app.api.services.nodes import node_registry
+    await node_registry.ensure_loaded()
+    return [
+        {**server, "breaker": node_registry._nodes[server["id"]].breaker.state}
+        for server in node_registry.servers()
+    ]
+
+
+@ops_router.get("/sync")
+async def get_sync_stats():
+    """Local Marzban user mirror sync status"""
+    from app.api.services.user_sync import user_sync_service
+    return user_sync_service.stats()
+
+
+@ops_router.get("/mutations")
+async def get_mutation_stats():
+    """Per-user mutation writes and coalescing counters"""
+    from app.api.services.mutations import mutation_service
+    return mutation_service.stats()
+
+
+@ops_router.get("/pools")
+async def get_pool_stats():
+    """Upstream and database connection pool occupancy"""
+    from app.api.services.http_pool import pool_stats
+    from app.api.services.subscription_proxy import sub_proxy
+    from app.api.db.database import pool_status
+    return {
+        "marzban": pool_stats(marzban_service.client),
+        "sub_proxy": sub_proxy.stats(),
+        "db": pool_status()
+    }
+
+
+@ops_router.get("/sub-cache")
+async def get_sub_cache_stats():
+    """Subscription document cache hit/miss counters"""
+    from app.api.services.subscription_proxy import sub_proxy
+    return sub_proxy.cache_stats()
+
+
+@ops_router.get("/devices")
+async def get_device_tracker_stats():
+    """Device write-behind buffer: pending, dropped and flushed sightings"""
+    from app.api.services.device_tracker import device_tracker
+    return device_tracker.stats()
+
+
+@ops_router.get("/tokens")
+async def get_token_index_stats():
+    """Subscription token index size and local-decode fallbacks"""
+    from app.api.services.token_index import token_index
+    return token_index.stats()
+
+
+@ops_router.get("/logging")
+async def get_logging_stats():
+    """Log queue depth and records dropped because the writer fell behind"""
+    from app.api.services.logging_setup import logging_stats
+    return logging_stats()
+
+
+@ops_router.get("/rate-limit")
+async def get_rate_limit_stats():
+    """/sub token-bucket limiter: live buckets and limited requests"""
+    from app.api.services.rate_limit import sub_rate_limiter
+    return sub_rate_limiter.stats()
+
+
+@ops_router.get("/sub-render")
+async def get_sub_render_stats():
+    """Local subscription rendering: documents rendered vs left to Marzban"""
+    from app.api.services.sub_renderer import sub_renderer
+    return sub_renderer.stats()
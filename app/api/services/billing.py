@@ -2,6 +2,7 @@ from yookassa import Configuration, Payment
 from app.api.db.database import AsyncSession
 from app.api.models import Transaction, User
 from app.api.schemas import PaymentInit
+from app.api.services.metrics import metrics
 import uuid
 import os
 
@@ -17,21 +18,22 @@ class BillingService:
         idempotence_key = str(uuid.uuid4())
         
         # Create payment in Yookassa
-        payment = Payment.create({
-            "amount": {
-                "value": f"{payment_data.amount:.2f}",
-                "currency": "RUB"
-            },
-            "confirmation": {
-                "type": "redirect",
-                "return_url": "https://t.me/your_bot_name" # Should be dynamic or env var
-            },
-            "capture": True,
-            "description": payment_data.description,
-            "metadata": {
-                "user_id": user_id
-            }
-        }, idempotence_key)
+        with metrics.track("yookassa", "Payment.create"):
+            payment = Payment.create({
+                "amount": {
+                    "value": f"{payment_data.amount:.2f}",
+                    "currency": "RUB"
+                },
+                "confirmation": {
+                    "type": "redirect",
+                    "return_url": "https://t.me/your_bot_name" # Should be dynamic or env var
+                },
+                "capture": True,
+                "description": payment_data.description,
+                "metadata": {
+                    "user_id": user_id
+                }
+            }, idempotence_key)
 
         # Save pending transaction to DB
         transaction = Transaction(
@@ -0,0 +1,77 @@
+"""
+TTL Cache - Bounded in-process cache with LRU eviction.
+Used to avoid repeated Marzban round trips for the same user.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+import time
+
+
+class TTLCache:
+    """LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, max_age: Optional[float] = None) -> Optional[Any]:
+        """Return a fresh value or None (counts as hit/miss); `max_age` tightens freshness below the TTL."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at, stored_at = entry
+        now = time.monotonic()
+        if expires_at < now or (max_age is not None and now - stored_at > max_age):
+            # Expired entries stay (until evicted) so get_stale() can serve them
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: Hashable) -> Optional[Any]:
+        """Return a value even if expired (fallback while the upstream is down)."""
+        entry = self._data.get(key)
+        return entry[0] if entry is not None else None
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entry if full."""
+        if self.maxsize <= 0:
+            return
+        now = time.monotonic()
+        self._data[key] = (value, now + (self.ttl if ttl is None else ttl), now)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Drop a single entry (no-op if missing)."""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Drop all entries."""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for monitoring."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
@@ -0,0 +1,140 @@
+"""
+Circuit Breaker - Fail fast while an upstream is down or too slow.
+closed -> open when the recent failure ratio crosses the threshold,
+open -> half-open after a cool-down, half-open -> closed on a successful probe.
+Only the probe itself decides the half-open outcome; calls that started while
+closed and finish late are ignored.
+"""
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit '{name}' is open, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Rolling-window circuit breaker; slow calls count as failures."""
+
+    def __init__(self, name: str, prefix: Optional[str] = None):
+        prefix = prefix or name.upper()
+        self.name = name
+        self.failure_ratio = float(os.getenv(f"{prefix}_BREAKER_FAILURE_RATIO", "0.5"))
+        self.min_calls = int(os.getenv(f"{prefix}_BREAKER_MIN_CALLS", "5"))
+        self.slow_call_seconds = float(os.getenv(f"{prefix}_BREAKER_SLOW_CALL", "10"))
+        self.open_seconds = float(os.getenv(f"{prefix}_BREAKER_OPEN_SECONDS", "30"))
+        self._window = deque(maxlen=int(os.getenv(f"{prefix}_BREAKER_WINDOW", "20")))
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_inflight = False
+        # Ticket of the current half-open probe; normal calls hold ticket 0
+        self._probe_id = 0
+        self.rejected = 0
+        self.opened_count = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_inflight = False
+        return self._state
+
+    def retry_after(self) -> float:
+        return max(self.open_seconds - (time.monotonic() - self._opened_at), 0.0)
+
+    def allow(self) -> Optional[int]:
+        """
+        Ticket for a call that may go upstream now, None if it may not: 0 while closed,
+        the probe's id for the one call half-open lets through.
+        """
+        state = self.state
+        if state == CLOSED:
+            return 0
+        if state == HALF_OPEN and not self._probe_inflight:
+            self._probe_inflight = True
+            self._probe_id += 1
+            return self._probe_id
+        self.rejected += 1
+        return None
+
+    def _is_current_probe(self, ticket: int) -> bool:
+        return ticket != 0 and ticket == self._probe_id and self._state == HALF_OPEN
+
+    def record(self, ok: bool, latency: float, ticket: int = 0):
+        """Outcome of a call admitted with `ticket` (from allow())."""
+        if latency > self.slow_call_seconds:
+            ok = False
+
+        if ticket:
+            if not self._is_current_probe(ticket):
+                return  # superseded probe
+            self._probe_inflight = False
+            if ok:
+                logger.info(f"Circuit '{self.name}' closed after successful probe")
+                self._state = CLOSED
+                self._window.clear()
+            else:
+                self._open()
+            return
+
+        if self._state != CLOSED:
+            # Started before the circuit opened: says nothing about the upstream now
+            return
+        self._window.append(ok)
+        failures = self._window.count(False)
+        if self._state == CLOSED and len(self._window) >= self.min_calls and failures / len(self._window) >= self.failure_ratio:
+            self._open()
+
+    def _open(self):
+        logger.warning(f"Circuit '{self.name}' opened for {self.open_seconds:.0f}s")
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_inflight = False
+        self._window.clear()
+        self.opened_count += 1
+
+    async def call(self, fn: Callable[[], Awaitable[Any]], is_failure: Optional[Callable[[Any], bool]] = None) -> Any:
+        """Run fn() through the breaker; raises CircuitOpenError while open."""
+        ticket = self.allow()
+        if ticket is None:
+            raise CircuitOpenError(self.name, self.retry_after())
+
+        start = time.monotonic()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # Caller went away: says nothing about upstream health, but frees the probe slot
+            if self._is_current_probe(ticket):
+                self._probe_inflight = False
+            raise
+        except Exception:
+            self.record(False, time.monotonic() - start, ticket)
+            raise
+        self.record(not (is_failure and is_failure(result)), time.monotonic() - start, ticket)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "window_failures": self._window.count(False),
+            "window_size": len(self._window),
+            "rejected": self.rejected,
+            "opened_count": self.opened_count,
+            "retry_after": round(self.retry_after(), 1) if self._state == OPEN else 0
+        }
@@ -0,0 +1,175 @@
+"""
+Compression - Accept-Encoding negotiation (brotli when installed, gzip) for both apps.
+Cacheable bodies (subscription documents, admin static files) keep their
+compressed variants next to the raw bytes; other responses are compressed
+per request by CompressionMiddleware.
+"""
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+import gzip
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from app.api.services.cache import TTLCache
+
+try:
+    import brotli
+except ImportError:  # listed in requirements.txt; gzip only without it
+    brotli = None
+
+MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "512"))
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+# Cached variants are built once, so they can afford a higher level than per-request ones
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+BROTLI_CACHED_QUALITY = int(os.getenv("COMPRESS_BROTLI_CACHED_QUALITY", "11"))
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/javascript", "application/xml",
+    "application/yaml", "image/svg+xml"
+)
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best encoding the client accepts (q > 0), in our preference order; None = identity."""
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, cached: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_CACHED_QUALITY if cached else BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=9 if cached else GZIP_LEVEL, mtime=0)
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+
+class VariantCache:
+    """Compressed copies of bodies that are served many times; each is compressed once, least recently used evicted."""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 86400):
+        # Keys carry the body's identity (e.g. mtime and size), so the TTL only bounds memory held by cold entries
+        self._data = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key: Any, encoding: str, load: Callable[[], bytes]) -> bytes:
+        """Variant of the body identified by `key`; `load` returns the raw body on a miss."""
+        variant = self._data.get((key, encoding))
+        if variant is None:
+            variant = compress(load(), encoding, cached=True)
+            self._data.set((key, encoding), variant)
+        return variant
+
+    def stats(self) -> Dict[str, Any]:
+        return self._data.stats()
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles serving a compressed variant per (file, mtime, size) built on first request."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.variants = VariantCache(maxsize=int(os.getenv("COMPRESS_STATIC_CACHE_SIZE", "256")))
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)
+        if not isinstance(response, FileResponse) or response.status_code != 200:
+            return response
+        request_headers = Headers(scope=scope)
+        # Byte ranges refer to the file itself, so those requests get the uncompressed FileResponse
+        if "range" in request_headers:
+            return response
+        encoding = negotiate(request_headers.get("accept-encoding"))
+        stat = response.stat_result
+        if encoding is None or not is_compressible(response.media_type) or stat is None or stat.st_size < MIN_SIZE:
+            return response
+
+        def load() -> bytes:
+            with open(response.path, "rb") as f:
+                return f.read()
+
+        # Response sets Content-Length for the compressed body; ranges are not offered on it
+        headers = MutableHeaders({k: v for k, v in response.headers.items()
+                                  if k not in ("content-length", "content-type", "accept-ranges")})
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+        if "etag" in headers:
+            # Different bytes than the file: an encoding-specific validator instead of the file's strong one
+            tag = headers["etag"].removeprefix("W/").strip('"')
+            headers["ETag"] = f'"{tag}-{encoding}"'
+            if_none_match = request_headers.get("if-none-match", "")
+            if headers["etag"] in (t.strip() for t in if_none_match.split(",")):
+                return NotModifiedResponse(headers)
+
+        key = (str(response.path), stat.st_mtime_ns, stat.st_size)
+        body = self.variants.get(key, encoding, load)
+        return Response(content=body, headers=dict(headers), media_type=response.media_type)
+
+
+class CompressionMiddleware:
+    """
+    Compresses complete (single-message) compressible responses per request.
+    Streamed responses and bodies that already carry Content-Encoding pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[dict] = None
+
+        async def wrapped_send(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message  # held until we know whether the body is complete
+                return
+            if start_message is None:
+                await send(message)
+                return
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < MIN_SIZE
+                or not is_compressible(headers.get("content-type"))
+            ):
+                await send(start)
+                await send(message)
+                return
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, wrapped_send)
@@ -0,0 +1,149 @@
+"""
+Device Tracker - Write-behind recording of devices polling /sub/{token}.
+The request path only drops an entry into a bounded in-memory buffer;
+a background worker resolves users and batch-upserts Device rows.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import random
+
+from sqlalchemy import insert, select, update
+
+from app.api.db.database import async_session_maker
+from app.api.models import Device
+from app.api.services.token_index import token_index
+from app.api.services.user_agent import UserAgentInfo
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class _Sighting:
+    token: str
+    ua: UserAgentInfo
+    ip: Optional[str]
+    seen_at: datetime
+
+
+class DeviceTracker:
+    """Bounded, deduplicating write-behind buffer for Device rows."""
+
+    def __init__(self):
+        self.enabled = os.getenv("DEVICE_TRACKING_ENABLED", "true").lower() != "false"
+        self.flush_interval = float(os.getenv("DEVICE_FLUSH_INTERVAL", "5"))
+        self.max_pending = int(os.getenv("DEVICE_QUEUE_SIZE", "10000"))
+        # Above this fill ratio new devices are sampled, at a rate falling to 0 when full
+        self.high_water = float(os.getenv("DEVICE_QUEUE_HIGH_WATER", "0.8"))
+        # (token, raw UA) -> latest sighting; repeated polls only overwrite
+        self._pending: Dict[Tuple[str, str], _Sighting] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.dropped = 0
+        self.flushed = 0
+
+    def record(self, token: str, ua: UserAgentInfo, ip: Optional[str]):
+        """Called on the request path after a 200: O(1), never awaits. Tokens not in the index are ignored."""
+        if not self.enabled or not ua.raw or token_index.resolve(token) is None:
+            return
+        key = (token, ua.raw)
+        if key not in self._pending:
+            fill = len(self._pending) / self.max_pending
+            if fill >= 1.0 or (fill > self.high_water and random.random() > (1.0 - fill) / (1.0 - self.high_water)):
+                self.dropped += 1
+                return
+        self._pending[key] = _Sighting(token, ua, ip, datetime.now(timezone.utc))
+        self.recorded += 1
+
+    async def flush(self) -> int:
+        """Write everything buffered so far in one transaction; returns rows touched."""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+
+        async with async_session_maker() as session:
+            user_ids = await token_index.user_ids(session, {s.token for s in batch.values()})
+            # One row per (user, UA): the latest sighting wins
+            latest: Dict[Tuple[int, str], _Sighting] = {}
+            for sighting in batch.values():
+                user_id = user_ids.get(sighting.token)
+                if user_id is None:
+                    continue
+                key = (user_id, sighting.ua.raw)
+                if key not in latest or latest[key].seen_at < sighting.seen_at:
+                    latest[key] = sighting
+            if not latest:
+                return 0
+
+            existing = await session.execute(
+                select(Device.id, Device.user_id, Device.user_agent)
+                .where(Device.user_id.in_({u for u, _ in latest}))
+            )
+            known = {(row.user_id, row.user_agent): row.id for row in existing}
+
+            new_rows: List[Dict[str, Any]] = []
+            changed_rows: List[Dict[str, Any]] = []
+            for (user_id, _), sighting in latest.items():
+                values = {
+                    **sighting.ua.device_dict(),
+                    "user_id": user_id,
+                    "ip_address": sighting.ip,
+                    "last_seen": sighting.seen_at
+                }
+                device_id = known.get((user_id, sighting.ua.raw))
+                if device_id is None:
+                    new_rows.append(values)
+                else:
+                    changed_rows.append({"id": device_id, **values})
+
+            if new_rows:
+                await session.execute(insert(Device), new_rows)
+            if changed_rows:
+                await session.execute(update(Device), changed_rows)
+            await session.commit()
+
+        self.flushed += len(latest)
+        return len(latest)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Device flush failed: {e}")
+
+    def start(self):
+        """Start the background flush loop (idempotent)."""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Final device flush failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._pending),
+            "max_pending": self.max_pending,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "flushed": self.flushed
+        }
+
+
+# Singleton instance
+device_tracker = DeviceTracker()
@@ -0,0 +1,64 @@
+"""
+HTTP Pool - Long-lived, tuned httpx clients built from environment settings.
+"""
+from typing import Any, Dict
+import logging
+import os
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() not in ("false", "0", "no", "")
+
+
+def build_async_client(prefix: str, timeout: float = 30.0) -> httpx.AsyncClient:
+    """
+    Build a pooled keep-alive client configured by `<PREFIX>_*` env vars:
+    POOL_MAX_CONNECTIONS, POOL_MAX_KEEPALIVE, KEEPALIVE_EXPIRY, TIMEOUT, HTTP2.
+    """
+    limits = httpx.Limits(
+        max_connections=int(os.getenv(f"{prefix}_POOL_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv(f"{prefix}_POOL_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(os.getenv(f"{prefix}_KEEPALIVE_EXPIRY", "60"))
+    )
+
+    http2 = _env_bool(f"{prefix}_HTTP2", "false")
+    if http2:
+        try:
+            import h2  # noqa: F401  (optional dependency: pip install httpx[http2])
+        except ImportError:
+            logger.warning(f"{prefix}_HTTP2 is set but the 'h2' package is not installed, using HTTP/1.1")
+            http2 = False
+
+    # SSL verification - use env var for self-signed certs in dev
+    verify_ssl = os.getenv("MARZBAN_VERIFY_SSL", "true").lower() != "false"
+    return httpx.AsyncClient(
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", str(timeout))),
+        verify=verify_ssl,
+        limits=limits,
+        http2=http2
+    )
+
+
+def pool_stats(client: httpx.AsyncClient) -> Dict[str, Any]:
+    """Connection pool occupancy (reads httpcore internals; empty if unavailable)."""
+    try:
+        pool = client._transport._pool
+        connections = pool.connections
+        idle = sum(1 for c in connections if c.is_idle())
+        return {
+            "connections": len(connections),
+            "idle": idle,
+            "active": len(connections) - idle,
+            "queued_requests": sum(1 for r in pool._requests if r.is_queued()),
+            "max_connections": pool._max_connections,
+            "max_keepalive": pool._max_keepalive_connections,
+            "keepalive_expiry": pool._keepalive_expiry,
+            "closed": client.is_closed
+        }
+    except Exception as e:
+        logger.debug(f"Pool stats unavailable: {e}")
+        return {}
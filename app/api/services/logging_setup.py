@@ -0,0 +1,236 @@
+"""
+Logging Setup - Queue-based, structured logging shared by the API and the bot.
+Records are handed to a bounded queue on the event loop and formatted and
+written by a background thread; hot loggers can be sampled or rate limited.
+
+    log_event(logger, logging.INFO, "sub request", token="abc", status=200)
+    -> 2026-01-01T12:00:00 INFO app.api.routers.subscription sub request token=abc status=200
+"""
+from typing import Any, Dict, Optional
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+
+# Values that cannot change after the call, so formatting them can wait for the writer thread
+_IMMUTABLE = (str, int, float, bool, bytes, type(None))
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields: Any):
+    """Structured record; nothing is formatted unless the level is enabled and the record is written."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def _kv(value: Any) -> str:
+    text = str(value)
+    if not text or any(c in text for c in ' ="\n'):
+        return json.dumps(text, ensure_ascii=False)
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    """`time level logger message key=value ...`, runs on the writer thread."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        parts = [
+            time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+            record.levelname,
+            record.name,
+            record.getMessage()
+        ]
+        fields: Dict[str, Any] = getattr(record, "fields", None) or {}
+        parts.extend(f"{key}={_kv(value)}" for key, value in fields.items())
+        line = " ".join(parts)
+        # Records from the queue carry the traceback as text only
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class TextFormatter(logging.Formatter):
+    """LOG_FORMAT=text: `asctime level logger message`, structured fields appended as key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        fields: Dict[str, Any] = getattr(record, "fields", None) or {}
+        if fields:
+            line += " " + " ".join(f"{key}={_kv(value)}" for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Keep roughly `rate` of records (0..1); WARNING and above always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket: at most `per_second` records per second (bursts up to one second's worth)."""
+
+    def __init__(self, per_second: float):
+        super().__init__()
+        self.per_second = per_second
+        self._tokens = per_second
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.per_second, self._tokens + (now - self._updated) * self.per_second)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.suppressed += 1
+            return False
+
+
+class LoggerRules(logging.Filter):
+    """Per-logger filters, matched by name prefix ("sqlalchemy.engine" covers "sqlalchemy.engine.Engine")."""
+
+    def __init__(self):
+        super().__init__()
+        self.rules: Dict[str, list] = {}
+        self._resolved: Dict[str, list] = {}
+
+    def add(self, name: str, rule: logging.Filter):
+        self.rules.setdefault(name, []).append(rule)
+        self._resolved.clear()
+
+    def _rules_for(self, name: str) -> list:
+        rules = self._resolved.get(name)
+        if rules is None:
+            prefix = name
+            while prefix not in self.rules and "." in prefix:
+                prefix = prefix.rsplit(".", 1)[0]
+            rules = self._resolved[name] = self.rules.get(prefix, [])
+        return rules
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return all(rule.filter(record) for rule in self._rules_for(record.name))
+
+
+_exception_formatter = logging.Formatter()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: a full queue drops the record."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Snapshot on the caller's thread whatever could change before the writer gets to it:
+        mutable args / fields are rendered now (immutable ones stay lazy), and the traceback
+        becomes text so frames and locals are not kept alive or read from another thread.
+        """
+        record = copy.copy(record)
+        # A lone dict argument ("%(key)s" style) is itself mutable
+        args = record.args or ()
+        if not isinstance(record.msg, str) or not isinstance(args, tuple) or not all(isinstance(a, _IMMUTABLE) for a in args):
+            record.msg = record.getMessage()
+            record.args = None
+        fields = getattr(record, "fields", None)
+        if fields:
+            record.fields = {k: v if isinstance(v, _IMMUTABLE) else str(v) for k, v in fields.items()}
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_map(value: str) -> Dict[str, float]:
+    """Parse "name=1.5,other=2" into {"name": 1.5, "other": 2.0}."""
+    result: Dict[str, float] = {}
+    for item in value.split(","):
+        name, _, number = item.partition("=")
+        if name.strip() and number.strip():
+            result[name.strip()] = float(number)
+    return result
+
+
+def setup_logging():
+    """Route root (and uvicorn) logging through one queue and a background writer; idempotent."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    stream = logging.StreamHandler(sys.stderr)
+    if os.getenv("LOG_FORMAT", "kv").lower() == "kv":
+        stream.setFormatter(KeyValueFormatter())
+    else:
+        stream.setFormatter(TextFormatter())
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, stream, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers = [_queue_handler]
+    root.setLevel(level)
+    # uvicorn installs its own synchronous handlers before the app is imported
+    for name in ("uvicorn", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        if uvicorn_logger.handlers:
+            uvicorn_logger.handlers = [_queue_handler]
+
+    # SQL statements go through the same queue (and sampling) instead of echo=True's own handler
+    if os.getenv("SQL_ECHO", "false").lower() == "true":
+        logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+
+    # Checked on the caller's side so dropped records never reach the queue
+    rules = LoggerRules()
+    for name, rate in _parse_map(os.getenv("LOG_SAMPLE", "")).items():
+        rules.add(name, SamplingFilter(rate))
+    for name, per_second in _parse_map(os.getenv("LOG_RATE_LIMIT", "")).items():
+        rules.add(name, RateLimitFilter(per_second))
+    if rules.rules:
+        _queue_handler.addFilter(rules)
+
+    _listener.start()
+
+
+def stop_logging():
+    """Flush what is queued and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> Dict[str, Any]:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0
+    }
@@ -0,0 +1,127 @@
+"""
+Marzban Auth - Shared JWT lifecycle for Marzban clients.
+Refreshes the admin token before it expires and serialises re-authentication.
+"""
+from typing import Any, Dict, Optional
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def decode_jwt_exp(token: str) -> Optional[float]:
+    """Read the `exp` claim from a JWT without verifying it."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp else None
+    except Exception:
+        return None
+
+
+class TokenManager:
+    """Owns the Marzban admin token: one re-auth at a time, proactive refresh."""
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str, username: str, password: str):
+        self.client = client
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        # Refresh this many seconds before `exp`
+        self.refresh_margin = float(os.getenv("MARZBAN_TOKEN_REFRESH_MARGIN", "60"))
+        self.token: Optional[str] = None
+        self.expires_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _is_fresh(self) -> bool:
+        if not self.token:
+            return False
+        if self.expires_at is None:
+            return True  # Unknown expiry: keep until Marzban answers 401
+        return time.time() < self.expires_at - self.refresh_margin
+
+    async def get_token(self) -> str:
+        """Return a valid token, authenticating if needed."""
+        if self._is_fresh():
+            return self.token
+        async with self._lock:
+            if not self._is_fresh():
+                await self._authenticate()
+        return self.token
+
+    async def refresh(self, stale_token: Optional[str] = None):
+        """Re-authenticate unless another coroutine already replaced `stale_token`."""
+        async with self._lock:
+            if stale_token is not None and self.token != stale_token:
+                return
+            await self._authenticate()
+
+    async def _authenticate(self):
+        """Get JWT token from Marzban"""
+        try:
+            response = await self.client.post(
+                f"{self.base_url}/api/admin/token",
+                data={"username": self.username, "password": self.password},
+                headers={"Content-Type": "application/x-www-form-urlencoded"}
+            )
+            response.raise_for_status()
+            self.token = response.json().get("access_token")
+            self.expires_at = decode_jwt_exp(self.token) if self.token else None
+            logger.info("Successfully authenticated with Marzban")
+        except Exception as e:
+            self.token = None
+            self.expires_at = None
+            logger.error(f"Failed to authenticate with Marzban: {e}")
+            raise
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        """Refresh in the background shortly before the token expires."""
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        self._refresh_task = None
+        if self.expires_at is None:
+            return
+        delay = max(self.expires_at - self.refresh_margin - time.time(), 1.0)
+        self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_later(delay, self.token))
+
+    async def _refresh_later(self, delay: float, token: str):
+        await asyncio.sleep(delay)
+        # Detach first so _authenticate doesn't cancel the task it runs in
+        self._refresh_task = None
+        try:
+            await self.refresh(stale_token=token)
+        except Exception as e:
+            logger.warning(f"Background token refresh failed: {e}")
+
+    def headers(self, token: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+    async def request(self, method: str, url: str, client: Optional[httpx.AsyncClient] = None, **kwargs: Any) -> httpx.Response:
+        """Authorized request; a 401 triggers one re-auth and one retry."""
+        client = client or self.client
+        extra_headers = kwargs.pop("headers", None) or {}
+
+        token = await self.get_token()
+        response = await client.request(method, url, headers={**self.headers(token), **extra_headers}, **kwargs)
+        if response.status_code != 401:
+            return response
+
+        logger.info(f"Marzban returned 401 for {method} {url}, re-authenticating")
+        await self.refresh(stale_token=token)
+        token = await self.get_token()
+        return await client.request(method, url, headers={**self.headers(token), **extra_headers}, **kwargs)
+
+    async def close(self):
+        """Stop the background refresh task."""
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        self._refresh_task = None
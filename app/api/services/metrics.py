@@ -0,0 +1,135 @@
+"""
+Metrics - Latency histograms, error counters and in-flight gauges per upstream.
+Rendered in Prometheus text format by /metrics (API) and the bot metrics server.
+"""
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+import re
+import time
+
+# Histogram bucket upper bounds (seconds)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_USER_PATH = re.compile(r"^/api/user/[^/]+")
+_SUB_PATH = re.compile(r"^/sub/[^/]+")
+
+Labels = Tuple[str, str]  # (upstream, endpoint)
+
+
+def endpoint_label(method: str, path: str) -> str:
+    """Low-cardinality endpoint label: usernames and tokens are collapsed."""
+    path = path.split("?", 1)[0]
+    path = _USER_PATH.sub("/api/user/{username}", path)
+    path = _SUB_PATH.sub("/sub/{token}", path)
+    return f"{method} {path}"
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class _Call:
+    """Handle yielded by Metrics.track; set `error` for failures that are not exceptions."""
+    __slots__ = ("error",)
+
+    def __init__(self):
+        self.error = False
+
+
+class Metrics:
+    """In-process metrics registry (single event loop, no locking needed)."""
+
+    def __init__(self):
+        self._latency: Dict[Labels, _Histogram] = {}
+        self._errors: Dict[Labels, int] = {}
+        self._inflight: Dict[Labels, int] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]):
+        """Register a gauge whose value is read at scrape time."""
+        self._gauges[name] = (help_text, read)
+
+    def observe(self, upstream: str, endpoint: str, seconds: float, error: bool = False):
+        labels = (upstream, endpoint)
+        histogram = self._latency.get(labels)
+        if histogram is None:
+            histogram = self._latency[labels] = _Histogram()
+        histogram.observe(seconds)
+        if error:
+            self._errors[labels] = self._errors.get(labels, 0) + 1
+        else:
+            self._errors.setdefault(labels, 0)
+
+    @contextmanager
+    def track(self, upstream: str, endpoint: str) -> Iterator[_Call]:
+        """Time a block; exceptions (and call.error = True) count as errors."""
+        labels = (upstream, endpoint)
+        call = _Call()
+        self._inflight[labels] = self._inflight.get(labels, 0) + 1
+        start = time.perf_counter()
+        try:
+            yield call
+        except BaseException:
+            call.error = True
+            raise
+        finally:
+            self._inflight[labels] -= 1
+            self.observe(upstream, endpoint, time.perf_counter() - start, call.error)
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines: List[str] = [
+            "# HELP upstream_request_duration_seconds Upstream call latency.",
+            "# TYPE upstream_request_duration_seconds histogram",
+        ]
+        for (upstream, endpoint), h in sorted(self._latency.items()):
+            label = _labels(upstream, endpoint)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, h.counts):
+                cumulative += count
+                lines.append(f'upstream_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'upstream_request_duration_seconds_bucket{{{label},le="+Inf"}} {h.count}')
+            lines.append(f"upstream_request_duration_seconds_sum{{{label}}} {h.sum:.6f}")
+            lines.append(f"upstream_request_duration_seconds_count{{{label}}} {h.count}")
+
+        lines.append("# HELP upstream_request_errors_total Failed upstream calls.")
+        lines.append("# TYPE upstream_request_errors_total counter")
+        for (upstream, endpoint), value in sorted(self._errors.items()):
+            lines.append(f"upstream_request_errors_total{{{_labels(upstream, endpoint)}}} {value}")
+
+        lines.append("# HELP upstream_requests_in_flight Upstream calls currently running.")
+        lines.append("# TYPE upstream_requests_in_flight gauge")
+        for (upstream, endpoint), value in sorted(self._inflight.items()):
+            lines.append(f"upstream_requests_in_flight{{{_labels(upstream, endpoint)}}} {value}")
+
+        for name, (help_text, read) in sorted(self._gauges.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {read()}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(upstream: str, endpoint: str) -> str:
+    upstream = upstream.replace("\\", "\\\\").replace('"', '\\"')
+    endpoint = endpoint.replace("\\", "\\\\").replace('"', '\\"')
+    return f'upstream="{upstream}",endpoint="{endpoint}"'
+
+
+# Content type expected by Prometheus scrapers
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Singleton instance
+metrics = Metrics()
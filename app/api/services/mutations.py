@@ -0,0 +1,144 @@
+"""
+Mutation Service - Serialised read-modify-write of Marzban users.
+One lock per username; deltas queued behind an in-progress write are merged into a single PUT.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import os
+import time
+
+from app.api.services.nodes import node_registry
+from app.api.services.xray import ADMIN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+
+
+@dataclass
+class _Batch:
+    """Deltas waiting for the user's lock; every contributor awaits the same result."""
+    future: asyncio.Future
+    days: int = 0
+    traffic_bytes: int = 0
+    contributors: int = 0
+
+
+class MutationService:
+    """Extend / add-traffic for a user without lost updates."""
+
+    def __init__(self):
+        # Cached user state younger than this is trusted as the base of a write
+        self.state_max_age = float(os.getenv("MUTATION_STATE_MAX_AGE", "2"))
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}  # callers holding or waiting on each lock
+        self._pending: Dict[str, _Batch] = {}
+        self.writes = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    async def apply(self, username: str, days: int = 0, traffic_bytes: int = 0) -> bool:
+        """Add `days` to expire and/or `traffic_bytes` to data_limit; True once Marzban has it."""
+        batch = self._pending.get(username)
+        if batch is None:
+            batch = self._pending[username] = _Batch(future=asyncio.get_running_loop().create_future())
+        else:
+            self.coalesced += 1
+        batch.days += days
+        batch.traffic_bytes += traffic_bytes
+        batch.contributors += 1
+
+        lock = self._locks.setdefault(username, asyncio.Lock())
+        self._lock_users[username] = self._lock_users.get(username, 0) + 1
+        try:
+            async with lock:
+                # Whoever gets the lock first writes everything queued so far
+                if self._pending.get(username) is batch:
+                    del self._pending[username]
+                    ok = False
+                    try:
+                        ok = await self._write(username, batch)
+                    finally:
+                        batch.future.set_result(ok)
+        except asyncio.CancelledError:
+            # Cancelled before the batch was written: take this caller's delta back out,
+            # otherwise the next lock holder applies a change its caller was told failed
+            if self._pending.get(username) is batch:
+                batch.days -= days
+                batch.traffic_bytes -= traffic_bytes
+                batch.contributors -= 1
+                if not batch.contributors:
+                    del self._pending[username]
+            raise
+        finally:
+            self._lock_users[username] -= 1
+            if not self._lock_users[username]:
+                del self._lock_users[username]
+                del self._locks[username]
+        # Shielded: one contributor being cancelled must not cancel the shared result
+        return await asyncio.shield(batch.future)
+
+    async def extend(self, username: str, days: int) -> bool:
+        return await self.apply(username, days=days)
+
+    async def add_traffic(self, username: str, gb: int) -> bool:
+        return await self.apply(username, traffic_bytes=gb * GB)
+
+    async def _current_state(self, service, username: str) -> Optional[Dict[str, Any]]:
+        cached = service.user_cache.get(username, max_age=self.state_max_age)
+        if cached is not None:
+            return cached
+        response = await service._request("GET", f"/api/user/{username}", timeout=ADMIN_TIMEOUT)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    async def _write(self, username: str, batch: _Batch) -> bool:
+        try:
+            service = await node_registry.service_for(username)
+            user = await self._current_state(service, username)
+            if user is None:
+                logger.error(f"Cannot modify {username}: user not found")
+                self.failed += 1
+                return False
+
+            changes: Dict[str, Any] = {}
+            if batch.days:
+                current_expire = user.get("expire") or 0
+                if current_expire == 0:
+                    # No expiry set, count from now
+                    changes["expire"] = int(time.time()) + batch.days * 86400
+                else:
+                    changes["expire"] = current_expire + batch.days * 86400
+            if batch.traffic_bytes:
+                changes["data_limit"] = (user.get("data_limit") or 0) + batch.traffic_bytes
+            if not changes:
+                return True
+
+            updated = await service.update_user(username, changes)
+            self.writes += 1
+            if updated is None:
+                self.failed += 1
+                return False
+            if batch.contributors > 1:
+                logger.info(f"Coalesced {batch.contributors} changes to {username} into one write: {changes}")
+            return True
+        except Exception as e:
+            logger.error(f"Error modifying user {username}: {e}")
+            self.failed += 1
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "locked_users": len(self._locks)
+        }
+
+
+# Singleton instance
+mutation_service = MutationService()
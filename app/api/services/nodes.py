@@ -0,0 +1,253 @@
+"""
+Node Registry - Multi-node Marzban support driven by the AppServer table.
+Keeps one pooled client + token per node, places new users on a node
+and routes each user's requests to the node recorded in Config.server_id.
+"""
+from typing import Optional, Dict, Any, List, AsyncIterator
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import select, func
+
+from app.api.db.database import async_session_maker
+from app.api.models import AppServer, Config, User
+from app.api.services.cache import TTLCache
+from app.api.services.sub_renderer import sub_renderer
+from app.api.services.subscription_proxy import sub_proxy
+from app.api.services.token_index import token_index
+from app.api.services.xray import ADMIN_TIMEOUT, MarzbanService, marzban_service
+
+logger = logging.getLogger(__name__)
+
+# Markers in the placement cache: "lives on the primary (env) node" / "no Config row yet"
+_DEFAULT_NODE = 0
+_UNPLACED = -1
+
+
+class NodeRegistry:
+    """Registry of Marzban nodes; the env-configured node is always available as the default."""
+
+    def __init__(self):
+        self.default = marzban_service
+        self._nodes: Dict[int, MarzbanService] = {}
+        self._servers: Dict[int, Dict[str, Any]] = {}
+        self._placements = TTLCache(
+            maxsize=int(os.getenv("NODE_PLACEMENT_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("NODE_PLACEMENT_CACHE_TTL", "300"))
+        )
+        self.default_region = os.getenv("NODE_DEFAULT_REGION") or None
+        self._lock = asyncio.Lock()
+        self._loaded_at = 0.0
+        self._reload_interval = float(os.getenv("NODE_RELOAD_INTERVAL", "60"))
+
+    async def load(self):
+        """(Re)load active AppServer rows, reusing clients of unchanged nodes."""
+        async with async_session_maker() as session:
+            result = await session.execute(select(AppServer).where(AppServer.is_active == True))  # noqa: E712
+            rows = result.scalars().all()
+
+        nodes: Dict[int, MarzbanService] = {}
+        servers: Dict[int, Dict[str, Any]] = {}
+        for row in rows:
+            url = row.api_url.rstrip("/")
+            existing = self._nodes.get(row.id)
+            if existing is not None and existing.base_url == url:
+                nodes[row.id] = existing
+            elif url == self.default.base_url:
+                nodes[row.id] = self.default
+            else:
+                nodes[row.id] = MarzbanService(base_url=url, username=row.api_user, password=row.api_password, name=f"marzban:{row.name}")
+            servers[row.id] = {"id": row.id, "name": row.name, "region": row.region}
+
+        for server_id, service in self._nodes.items():
+            if server_id not in nodes and service is not self.default:
+                await service.close()
+
+        self._nodes = nodes
+        self._servers = servers
+        logger.info(f"Loaded {len(nodes)} Marzban node(s)")
+
+    async def ensure_loaded(self):
+        if time.monotonic() - self._loaded_at < self._reload_interval:
+            return
+        async with self._lock:
+            if time.monotonic() - self._loaded_at < self._reload_interval:
+                return
+            try:
+                await self.load()
+            except Exception as e:
+                # No servers table yet: single-node mode on the env node
+                logger.error(f"Failed to load Marzban nodes: {e}")
+            self._loaded_at = time.monotonic()
+
+    def services(self) -> List[MarzbanService]:
+        """Every distinct node client, the default node first."""
+        result = [self.default]
+        for service in self._nodes.values():
+            if service not in result:
+                result.append(service)
+        return result
+
+    def servers(self) -> List[Dict[str, Any]]:
+        return list(self._servers.values())
+
+    async def get_all_users(self) -> List[Dict[str, Any]]:
+        """Full user listing of every node, merged."""
+        await self.ensure_loaded()
+        listings = await asyncio.gather(*(service.get_all_users() for service in self.services()))
+        return [user for users in listings for user in users]
+
+    async def get_users_page(self, offset: int = 0, limit: int = 20, status: Optional[str] = None,
+                             search: Optional[str] = None) -> Dict[str, Any]:
+        """
+        One page over all nodes in services() order, same shape as MarzbanService.get_users_page;
+        `error` is set if any node failed.
+        """
+        await self.ensure_loaded()
+        services = self.services()
+        if len(services) == 1:
+            return await services[0].get_users_page(offset, limit, status, search)
+
+        # Node totals first, then walk the nodes as one concatenated listing
+        counts = await asyncio.gather(*(service.get_users_page(0, 1, status, search) for service in services))
+        if any(count.get("error") for count in counts):
+            return {"users": [], "total": 0, "error": True}
+        users: List[Dict[str, Any]] = []
+        for service, count in zip(services, counts):
+            if len(users) >= limit:
+                break
+            if offset >= count["total"]:
+                offset -= count["total"]
+                continue
+            page = await service.get_users_page(offset, limit - len(users), status, search)
+            if page.get("error"):
+                return {"users": [], "total": 0, "error": True}
+            users.extend(page["users"])
+            offset = 0
+        return {"users": users, "total": sum(count["total"] for count in counts)}
+
+    async def iter_users(self, page_size: int = 100, status: Optional[str] = None,
+                         search: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the users of every node, node by node and page by page."""
+        await self.ensure_loaded()
+        for service in self.services():
+            async for user in service.iter_users(page_size, status, search):
+                yield user
+
+    async def count_users(self, status: Optional[str] = None, search: Optional[str] = None) -> int:
+        await self.ensure_loaded()
+        totals = await asyncio.gather(*(service.count_users(status, search) for service in self.services()))
+        return sum(totals)
+
+    async def _placement(self, username: str) -> int:
+        """Config.server_id for a Marzban username, _DEFAULT_NODE, or _UNPLACED if there is no Config row."""
+        cached = self._placements.get(username)
+        if cached is not None:
+            return cached
+
+        async with async_session_maker() as session:
+            row = (await session.execute(
+                select(Config.server_id).where(Config.email == username).order_by(Config.id.desc()).limit(1)
+            )).first()
+        placement = _UNPLACED if row is None else (row.server_id or _DEFAULT_NODE)
+        self._placements.set(username, placement)
+        return placement
+
+    async def server_id_for(self, username: str) -> Optional[int]:
+        """Node recorded in Config.server_id for a Marzban username (None = default node)."""
+        placement = await self._placement(username)
+        return placement if placement > 0 else None
+
+    async def service_for(self, username: str) -> MarzbanService:
+        """Client for the node this user lives on."""
+        await self.ensure_loaded()
+        if not self._nodes:
+            return self.default
+        try:
+            server_id = await self.server_id_for(username)
+        except Exception as e:
+            logger.error(f"Error resolving node for {username}: {e}")
+            return self.default
+        return self._nodes.get(server_id, self.default)
+
+    async def choose_node(self, region: Optional[str] = None) -> Optional[int]:
+        """Pick the least-loaded healthy node, preferring `region`; None means the default node."""
+        await self.ensure_loaded()
+        if not self._nodes:
+            return None
+
+        healthy = [sid for sid, svc in self._nodes.items() if svc.breaker.state != "open"] or list(self._nodes)
+        region = region or self.default_region
+        candidates = [sid for sid in healthy if region and self._servers[sid]["region"] == region] or healthy
+
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(Config.server_id, func.count())
+                .where(Config.is_active == True, Config.server_id.in_(candidates))  # noqa: E712
+                .group_by(Config.server_id)
+            )
+            load = dict(result.all())
+        return min(candidates, key=lambda sid: (load.get(sid, 0), sid))
+
+    async def create_user(self, telegram_id: int, username: str = "User", region: Optional[str] = None,
+                          need_body: bool = True) -> Dict[str, Any]:
+        """
+        Create (or fetch) the user on their node, placing new users and recording Config.server_id.
+        With need_body=False an already confirmed user may come back as just {"username": ...}.
+        """
+        marzban_username = f"user_{telegram_id}"
+        await self.ensure_loaded()
+        placement = await self._placement(marzban_username)
+        known = placement != _UNPLACED
+        server_id = placement if placement > 0 else None
+
+        if not known and self._nodes:
+            # No Config row: users from before multi-node live on the primary node and must stay
+            # there (placing them elsewhere would create a second account and key). Only users
+            # Marzban has never seen are placed; a failed lookup raises instead of guessing.
+            if await self.default.fetch_user(marzban_username, timeout=ADMIN_TIMEOUT) is None:
+                server_id = await self.choose_node(region)
+        service = self._nodes.get(server_id, self.default)
+
+        marzban_user = await service.create_or_update_user(telegram_id, username, need_body=need_body)
+        if "subscription_url" in marzban_user or not known:
+            await self.record_placement(telegram_id, server_id, marzban_user)
+        return marzban_user
+
+    async def record_placement(self, telegram_id: int, server_id: Optional[int], marzban_user: Dict[str, Any]):
+        """Upsert the user's Config row (node, uuid, subscription URL)."""
+        marzban_username = f"user_{telegram_id}"
+        try:
+            async with async_session_maker() as session:
+                user_id = await session.scalar(select(User.id).where(User.telegram_id == telegram_id))
+                config = (await session.execute(
+                    select(Config).where(Config.email == marzban_username).order_by(Config.id.desc()).limit(1)
+                )).scalars().first()
+                if config is None:
+                    config = Config(email=marzban_username)
+                    session.add(config)
+                config.user_id = user_id or config.user_id
+                config.server_id = server_id
+                config.uuid = ((marzban_user.get("proxies") or {}).get("vless") or {}).get("id") or config.uuid
+                config.subscription_url = marzban_user.get("subscription_url") or config.subscription_url
+                config.vless_link = "\n".join(marzban_user.get("links") or []) or config.vless_link
+                config.is_active = True
+                await session.commit()
+            self._placements.set(marzban_username, server_id or _DEFAULT_NODE)
+            old_token = token_index.add(marzban_username, config.subscription_url, config.user_id)
+            if old_token is not None:
+                # Regenerated key: the old subscription must stop being served from cache
+                sub_proxy.invalidate(old_token)
+            sub_renderer.invalidate(marzban_username)
+        except Exception as e:
+            logger.error(f"Failed to record node placement for {marzban_username}: {e}")
+
+    async def close(self):
+        for service in self.services():
+            await service.close()
+
+
+# Singleton instance
+node_registry = NodeRegistry()
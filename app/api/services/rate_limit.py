@@ -0,0 +1,145 @@
+"""
+Rate Limit - In-process token buckets for /sub/{token}.
+Buckets are keyed by subscription token and by client IP, bounded in number
+and dropped once idle long enough to have refilled (so eviction loses nothing).
+Behind a reverse proxy the client IP is taken from X-Forwarded-For, but only
+when the peer is listed in SUB_TRUSTED_PROXIES.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+import ipaddress
+import os
+import time
+
+
+class TokenBucketLimiter:
+    """`rate` requests per second on average with bursts of up to `burst`, per key."""
+
+    def __init__(self, rate: float, burst: float, maxsize: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        # A bucket untouched this long is full again: same as not having one
+        self.idle_ttl = burst / rate if rate > 0 else float("inf")
+        # key -> [tokens, updated_at], least recently used first
+        self._buckets: "OrderedDict[Hashable, List[float]]" = OrderedDict()
+        self.limited = 0
+
+    def _refill(self, key: Hashable, now: float) -> List[float]:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            self._evict(now)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _evict(self, now: float):
+        while self._buckets:
+            key, (_, updated_at) = next(iter(self._buckets.items()))
+            if len(self._buckets) > self.maxsize or now - updated_at >= self.idle_ttl:
+                del self._buckets[key]
+            else:
+                break
+
+    def retry_after(self, key: Hashable, now: float) -> float:
+        """Seconds until a request for `key` would be allowed (0 = allowed now); consumes nothing."""
+        tokens = self._refill(key, now)[0]
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, key: Hashable):
+        self._buckets[key][0] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"rate": self.rate, "burst": self.burst, "buckets": len(self._buckets), "limited": self.limited}
+
+
+class TrustedProxies:
+    """
+    Client address resolution like uvicorn's --forwarded-allow-ips: X-Forwarded-For
+    is walked from the right while hops are trusted proxies; the first other hop is the client.
+    """
+
+    def __init__(self, spec: str):
+        entries = [e.strip() for e in spec.split(",") if e.strip()]
+        self.trust_all = "*" in entries
+        self.networks = [ipaddress.ip_network(e, strict=False) for e in entries if e != "*"]
+
+    def __bool__(self) -> bool:
+        return self.trust_all or bool(self.networks)
+
+    def is_trusted(self, host: Optional[str]) -> bool:
+        if self.trust_all:
+            return True
+        try:
+            address = ipaddress.ip_address(host or "")
+        except ValueError:
+            return False
+        return any(address in network for network in self.networks)
+
+    def client_ip(self, peer: Optional[str], forwarded_for: Optional[str]) -> str:
+        if not forwarded_for or not self.is_trusted(peer):
+            return peer or "unknown"
+        hops = [h.strip() for h in forwarded_for.split(",") if h.strip()]
+        for hop in reversed(hops):
+            if not self.is_trusted(hop):
+                return hop
+        # Every hop is a proxy we trust: the left-most is as close to the client as we know
+        return hops[0] if hops else (peer or "unknown")
+
+
+class SubRateLimiter:
+    """Per-token and per-IP limits; a request must fit both and only then spends from both."""
+
+    def __init__(self):
+        self.enabled = os.getenv("SUB_RATE_LIMIT_ENABLED", "true").lower() != "false"
+        max_buckets = int(os.getenv("SUB_RATE_MAX_BUCKETS", "100000"))
+        self.per_token = TokenBucketLimiter(
+            rate=float(os.getenv("SUB_RATE_TOKEN_RATE", "0.2")),
+            burst=float(os.getenv("SUB_RATE_TOKEN_BURST", "10")),
+            maxsize=max_buckets
+        )
+        self.per_ip = TokenBucketLimiter(
+            rate=float(os.getenv("SUB_RATE_IP_RATE", "2")),
+            burst=float(os.getenv("SUB_RATE_IP_BURST", "30")),
+            maxsize=max_buckets
+        )
+        # Empty = X-Forwarded-For is ignored, so behind a proxy every client shares the proxy's bucket
+        self.trusted_proxies = TrustedProxies(os.getenv("SUB_TRUSTED_PROXIES", ""))
+
+    def client_ip(self, peer: Optional[str], forwarded_for: Optional[str]) -> str:
+        """Address the per-IP limit applies to: the connecting peer, or the forwarded client behind a trusted proxy."""
+        return self.trusted_proxies.client_ip(peer, forwarded_for)
+
+    def check(self, token: str, ip: str) -> float:
+        """0 if the request may reach the proxy, else seconds to wait (for Retry-After)."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        wait_token = self.per_token.retry_after(token, now)
+        wait_ip = self.per_ip.retry_after(ip, now)
+        if wait_token or wait_ip:
+            if wait_token:
+                self.per_token.limited += 1
+            if wait_ip:
+                self.per_ip.limited += 1
+            return max(wait_token, wait_ip)
+        self.per_token.consume(token)
+        self.per_ip.consume(ip)
+        return 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "token": self.per_token.stats(),
+            "ip": self.per_ip.stats(),
+            "trusted_proxies": bool(self.trusted_proxies)
+        }
+
+
+# Singleton instance
+sub_rate_limiter = SubRateLimiter()
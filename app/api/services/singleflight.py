@@ -0,0 +1,39 @@
+"""
+Single-flight - Coalesce concurrent identical async calls.
+Callers asking for the same key while a call is in flight share its result.
+"""
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import asyncio
+
+
+class SingleFlight:
+    """Run at most one in-flight call per key."""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn() once for all concurrent callers of the same key."""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.shared += 1
+            # shield: one caller being cancelled must not cancel the shared call
+            return await asyncio.shield(future)
+
+        self.calls += 1
+        future = asyncio.ensure_future(fn())
+        self._inflight[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return await asyncio.shield(future)
+
+    def _done(self, key: Hashable, future: asyncio.Future):
+        self._inflight.pop(key, None)
+        # Mark the exception retrieved even if every caller was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> Dict[str, int]:
+        """Upstream calls vs. calls served by an in-flight request."""
+        return {"inflight": len(self._inflight), "calls": self.calls, "shared": self.shared}
@@ -0,0 +1,120 @@
+"""
+Status Poller - Background /api/system poll of every node, shared by every caller in the process.
+Readers get the latest immutable snapshot (with its age) instead of hitting Marzban.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional
+import asyncio
+import logging
+import os
+import time
+
+from app.api.services.nodes import node_registry
+from app.api.services.xray import format_server_status
+
+logger = logging.getLogger(__name__)
+
+# Per-node counters that add up across nodes; everything else is taken from the first node online
+_SUMMED_FIELDS = ("mem_total", "mem_used", "cpu_cores", "total_user", "users_active", "online_users",
+                  "incoming_bandwidth", "outgoing_bandwidth", "incoming_bandwidth_speed", "outgoing_bandwidth_speed")
+
+
+def merge_systems(systems: List[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """One /api/system-shaped payload for all nodes (None = none reachable); cpu_usage is the mean."""
+    online = [s for s in systems if s is not None]
+    if not online:
+        return None
+    merged = dict(online[0])
+    for name in _SUMMED_FIELDS:
+        if any(name in s for s in online):
+            merged[name] = sum(s.get(name) or 0 for s in online)
+    merged["cpu_usage"] = round(sum(s.get("cpu_usage") or 0 for s in online) / len(online), 1)
+    merged["nodes_online"] = len(online)
+    merged["nodes_total"] = len(systems)
+    return merged
+
+
+@dataclass(frozen=True)
+class StatusSnapshot:
+    """One /api/system round; `system` merges all nodes and is None when none was reachable."""
+    system: Optional[Mapping[str, Any]]
+    fetched_at: float  # time.monotonic()
+    checked_at: datetime
+    # Node name -> its own /api/system payload (None = unreachable)
+    nodes: Mapping[str, Optional[Mapping[str, Any]]] = field(default_factory=lambda: MappingProxyType({}))
+
+    @property
+    def online(self) -> bool:
+        return self.system is not None
+
+    @property
+    def age(self) -> float:
+        """Seconds since this snapshot was taken."""
+        return time.monotonic() - self.fetched_at
+
+    def server_status(self) -> Dict[str, Any]:
+        """Same shape as MarzbanService.get_server_status, plus the snapshot age."""
+        status = format_server_status(self.system)
+        status["age"] = round(self.age, 1)
+        return status
+
+
+class StatusPoller:
+    """Polls /api/system of every Marzban node on an interval and publishes snapshots."""
+
+    def __init__(self):
+        self.interval = float(os.getenv("STATUS_POLL_INTERVAL", "15"))
+        self.timeout = float(os.getenv("STATUS_POLL_TIMEOUT", "5"))
+        self._snapshot: Optional[StatusSnapshot] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def poll_once(self) -> StatusSnapshot:
+        await node_registry.ensure_loaded()
+        services = node_registry.services()
+        systems = await asyncio.gather(*(service.get_system(timeout=self.timeout) for service in services))
+        data = merge_systems(systems)
+        self._snapshot = StatusSnapshot(
+            system=MappingProxyType(data) if data is not None else None,
+            fetched_at=time.monotonic(),
+            checked_at=datetime.now(),
+            nodes=MappingProxyType({
+                service.name: MappingProxyType(dict(system)) if system is not None else None
+                for service, system in zip(services, systems)
+            })
+        )
+        return self._snapshot
+
+    async def snapshot(self) -> StatusSnapshot:
+        """Latest snapshot; polls inline only if there is none yet or the loop has stalled."""
+        current = self._snapshot
+        if current is None or current.age > self.interval * 3:
+            return await self.poll_once()
+        return current
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll_once()
+            except Exception as e:
+                logger.error(f"Server status poll failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start the background poll loop (idempotent)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Singleton instance
+status_poller = StatusPoller()
@@ -0,0 +1,283 @@
+"""
+Subscription Renderer - Builds /sub documents locally instead of proxying Marzban.
+Links come from Config.vless_link (stored when a user is placed), usage and
+status from the marzban_users mirror. Documents are cached per user and
+client type and re-rendered only when that input changes.
+
+    v2ray / Happ / Streisand / other  -> base64 link list
+    clash-meta (Mihomo)               -> YAML
+    sing-box                          -> JSON
+    clash, outline                    -> not rendered (no VLESS support), proxied as before
+"""
+from dataclasses import dataclass
+from email.utils import formatdate
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+import base64
+import hashlib
+import json
+import logging
+import os
+
+from sqlalchemy import select
+
+from app.api.db.database import async_session_maker
+from app.api.models import Config, MarzbanUser
+from app.api.services.cache import TTLCache
+from app.api.services.subscription_proxy import SubscriptionDocument
+from app.api.services.token_index import token_index
+from app.api.services.user_agent import client_type
+
+logger = logging.getLogger(__name__)
+
+# Local proxy port and TUN (system-wide) mode in the generated Mihomo / sing-box configs
+MIXED_PORT = int(os.getenv("SUB_RENDER_MIXED_PORT", "7890"))
+TUN = os.getenv("SUB_RENDER_TUN", "true").lower() != "false"
+
+
+def parse_vless(link: str) -> Optional[Dict[str, Any]]:
+    """vless://uuid@host:port?type=..&security=..#name -> fields; None if not a VLESS link."""
+    try:
+        parts = urlsplit(link.strip())
+        if parts.scheme != "vless" or not parts.hostname or not parts.username:
+            return None
+        params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        return {
+            "name": unquote(parts.fragment) or parts.hostname,
+            "uuid": parts.username,
+            "server": parts.hostname,
+            "port": parts.port or 443,
+            "network": params.get("type", "tcp"),
+            "security": params.get("security", "none"),
+            "params": params
+        }
+    except ValueError:
+        return None
+
+
+def clash_proxy(link: Dict[str, Any]) -> Dict[str, Any]:
+    params = link["params"]
+    proxy: Dict[str, Any] = {
+        "name": link["name"], "type": "vless", "server": link["server"], "port": link["port"],
+        "uuid": link["uuid"], "network": link["network"], "udp": True,
+        "tls": link["security"] in ("tls", "reality")
+    }
+    if params.get("flow"):
+        proxy["flow"] = params["flow"]
+    if params.get("sni"):
+        proxy["servername"] = params["sni"]
+    if params.get("fp"):
+        proxy["client-fingerprint"] = params["fp"]
+    if link["security"] == "reality":
+        proxy["reality-opts"] = {"public-key": params.get("pbk", ""), "short-id": params.get("sid", "")}
+    if link["network"] == "ws":
+        proxy["ws-opts"] = {"path": params.get("path", "/"), **({"headers": {"Host": params["host"]}} if params.get("host") else {})}
+    elif link["network"] == "grpc":
+        proxy["grpc-opts"] = {"grpc-service-name": params.get("serviceName", "")}
+    return proxy
+
+
+def singbox_outbound(link: Dict[str, Any]) -> Dict[str, Any]:
+    params = link["params"]
+    outbound: Dict[str, Any] = {
+        "type": "vless", "tag": link["name"], "server": link["server"], "server_port": link["port"],
+        "uuid": link["uuid"]
+    }
+    if params.get("flow"):
+        outbound["flow"] = params["flow"]
+    if link["security"] in ("tls", "reality"):
+        tls: Dict[str, Any] = {"enabled": True, "server_name": params.get("sni", link["server"])}
+        if params.get("fp"):
+            tls["utls"] = {"enabled": True, "fingerprint": params["fp"]}
+        if link["security"] == "reality":
+            tls["reality"] = {"enabled": True, "public_key": params.get("pbk", ""), "short_id": params.get("sid", "")}
+        outbound["tls"] = tls
+    if link["network"] == "ws":
+        outbound["transport"] = {"type": "ws", "path": params.get("path", "/"),
+                                 **({"headers": {"Host": params["host"]}} if params.get("host") else {})}
+    elif link["network"] == "grpc":
+        outbound["transport"] = {"type": "grpc", "service_name": params.get("serviceName", "")}
+    return outbound
+
+
+def render_base64(links: List[str]) -> Tuple[bytes, str]:
+    return base64.b64encode("\n".join(links).encode()), "text/plain; charset=utf-8"
+
+
+def render_clash_meta(links: List[str]) -> Tuple[bytes, str]:
+    proxies = [clash_proxy(p) for p in map(parse_vless, links) if p]
+    names = [p["name"] for p in proxies]
+    # JSON flow mappings are valid YAML, so no YAML library is needed
+    lines = [
+        f"mixed-port: {MIXED_PORT}",
+        "allow-lan: false",
+        "mode: rule",
+        "tun: " + json.dumps({
+            "enable": TUN, "stack": "system", "auto-route": True, "auto-detect-interface": True,
+            "dns-hijack": ["any:53"]
+        }),
+        "proxies:"
+    ]
+    lines += [f"  - {json.dumps(p, ensure_ascii=False)}" for p in proxies]
+    lines += [
+        "proxy-groups:",
+        f"  - {json.dumps({'name': 'Proxy', 'type': 'select', 'proxies': names}, ensure_ascii=False)}",
+        "rules:",
+        "  - MATCH,Proxy",
+        ""
+    ]
+    return "\n".join(lines).encode(), "text/yaml; charset=utf-8"
+
+
+def render_singbox(links: List[str]) -> Tuple[bytes, str]:
+    outbounds = [singbox_outbound(p) for p in map(parse_vless, links) if p]
+    tags = [o["tag"] for o in outbounds]
+    inbounds: List[Dict[str, Any]] = [
+        {"type": "mixed", "tag": "mixed-in", "listen": "127.0.0.1", "listen_port": MIXED_PORT}
+    ]
+    if TUN:
+        inbounds.insert(0, {
+            "type": "tun", "tag": "tun-in", "address": ["172.19.0.1/30"],
+            "auto_route": True, "strict_route": True, "stack": "system"
+        })
+    document = {
+        "inbounds": inbounds,
+        "outbounds": [
+            {"type": "selector", "tag": "proxy", "outbounds": tags},
+            *outbounds,
+            {"type": "direct", "tag": "direct"}
+        ],
+        "route": {"final": "proxy", "auto_detect_interface": True}
+    }
+    return json.dumps(document, ensure_ascii=False, indent=2).encode(), "application/json"
+
+
+RENDERERS = {
+    "clash-meta": render_clash_meta,
+    "sing-box": render_singbox,
+    "happ": render_base64,
+    "v2rayn": render_base64,
+    "streisand": render_base64,
+    "other": render_base64,
+}
+
+
+@dataclass(frozen=True)
+class _UserState:
+    """Everything a rendered document depends on."""
+    links: Tuple[str, ...]
+    status: Optional[str]
+    used_traffic: int
+    data_limit: int
+    expire: int
+
+
+class SubscriptionRenderer:
+    """Local /sub rendering for indexed tokens of active users; returns None to fall back to the proxy."""
+
+    def __init__(self):
+        self.enabled = os.getenv("SUB_LOCAL_RENDER", "false").lower() == "true"
+        self.update_interval = os.getenv("SUB_UPDATE_INTERVAL", "12")
+        self.profile_title = os.getenv("SUB_PROFILE_TITLE", "MomsVPN")
+        self.support_url = os.getenv("SUB_SUPPORT_URL", "")
+        self.happ_announce = os.getenv("SUB_HAPP_ANNOUNCE", "")
+        self.happ_routing = os.getenv("SUB_HAPP_ROUTING", "")
+        # Re-read a user's links and usage from the DB at most this often
+        self.state = TTLCache(
+            maxsize=int(os.getenv("SUB_RENDER_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("SUB_RENDER_STATE_TTL", "30"))
+        )
+        # (username, client type) -> (state, document); kept until the state changes
+        self.documents = TTLCache(maxsize=int(os.getenv("SUB_RENDER_CACHE_SIZE", "10000")), ttl=86400)
+        self.rendered = 0
+        self.declined = 0
+
+    async def _load_state(self, username: str) -> Optional[_UserState]:
+        state = self.state.get(username)
+        if state is not None:
+            return state
+        async with async_session_maker() as session:
+            vless_link = await session.scalar(
+                select(Config.vless_link)
+                .where(Config.email == username, Config.is_active == True)  # noqa: E712
+                .order_by(Config.id.desc()).limit(1)
+            )
+            user = await session.get(MarzbanUser, username)
+        if not vless_link or user is None:
+            return None
+        state = _UserState(
+            links=tuple(line for line in vless_link.splitlines() if line.strip()),
+            status=user.status,
+            used_traffic=user.used_traffic or 0,
+            data_limit=user.data_limit or 0,
+            expire=user.expire or 0
+        )
+        self.state.set(username, state)
+        return state
+
+    def _headers(self, state: _UserState, kind: str, content_type: str) -> Dict[str, str]:
+        headers = {
+            "content-type": content_type,
+            "subscription-userinfo": f"upload=0; download={state.used_traffic}; total={state.data_limit}; expire={state.expire}",
+            "profile-update-interval": self.update_interval,
+            "profile-title": "base64:" + base64.b64encode(self.profile_title.encode()).decode()
+        }
+        if self.support_url:
+            headers["support-url"] = self.support_url
+        if kind == "happ":
+            if self.happ_announce:
+                headers["announce"] = "base64:" + base64.b64encode(self.happ_announce.encode()).decode()
+            if self.happ_routing:
+                headers["routing"] = self.happ_routing
+        return headers
+
+    async def render(self, token: str, user_agent: str) -> Optional[SubscriptionDocument]:
+        if not self.enabled:
+            return None
+        kind = client_type(user_agent)
+        renderer = RENDERERS.get(kind)
+        # Only tokens the index knows are genuine and current
+        owner = token_index.resolve(token)
+        if renderer is None or owner is None:
+            self.declined += 1
+            return None
+        try:
+            state = await self._load_state(owner.username)
+        except Exception as e:
+            logger.error(f"Failed to load subscription state for {owner.username}: {e}")
+            state = None
+        # Disabled / expired / limited users are left to Marzban's own handling
+        if state is None or state.status != "active":
+            self.declined += 1
+            return None
+
+        cached = self.documents.get((owner.username, kind))
+        if cached is not None and cached[0] == state:
+            return cached[1]
+
+        body, content_type = renderer(list(state.links))
+        document = SubscriptionDocument(
+            status_code=200, body=body, headers=self._headers(state, kind, content_type),
+            etag=f'"{hashlib.sha1(body + repr(state).encode()).hexdigest()[:20]}"',
+            last_modified=formatdate(usegmt=True)
+        )
+        self.documents.set((owner.username, kind), (state, document))
+        self.rendered += 1
+        return document
+
+    def invalidate(self, username: str):
+        """Drop cached input so the next request re-reads links and usage (after create / regenerate / link changes)."""
+        self.state.invalidate(username)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "rendered": self.rendered,
+            "declined": self.declined,
+            "documents": self.documents.stats(),
+            "state": self.state.stats()
+        }
+
+
+# Singleton instance
+sub_renderer = SubscriptionRenderer()
@@ -0,0 +1,319 @@
+"""
+Subscription Proxy - Upstream side of the /sub/{token} proxy.
+One long-lived keep-alive pool for all subscription fetches (each routed to
+the node its user lives on), plus a per-(token, client type) document cache
+with conditional requests and stale-while-revalidate.
+"""
+from dataclasses import dataclass, field
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+import httpx
+
+from app.api.services.cache import TTLCache
+from app.api.services.compression import compress
+from app.api.services.http_pool import build_async_client, pool_stats
+from app.api.services.metrics import metrics
+from app.api.services.singleflight import SingleFlight
+from app.api.services.token_index import token_index
+from app.api.services.user_agent import CLIENT_TYPES, client_type
+from app.api.services.xray import MarzbanService, marzban_service
+
+logger = logging.getLogger(__name__)
+
+# Upstream headers passed through to clients (and kept with cached documents)
+DEFAULT_PASSTHROUGH_HEADERS = (
+    "content-type,content-disposition,subscription-userinfo,profile-update-interval,"
+    "profile-title,profile-web-page-url,support-url,announce,routing"
+)
+PASSTHROUGH_HEADERS = tuple(
+    h.strip().lower() for h in os.getenv("SUB_PASSTHROUGH_HEADERS", DEFAULT_PASSTHROUGH_HEADERS).split(",") if h.strip()
+)
+
+
+def passthrough_headers(upstream: httpx.Headers) -> Dict[str, str]:
+    return {name: upstream[name] for name in PASSTHROUGH_HEADERS if name in upstream}
+
+
+@dataclass
+class SubscriptionDocument:
+    """A subscription response as served to clients."""
+    status_code: int
+    body: bytes
+    headers: Dict[str, str] = field(default_factory=dict)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fetched_at: float = field(default_factory=time.monotonic)
+    # Encoding -> compressed body, built on first request for that encoding
+    variants: Dict[str, bytes] = field(default_factory=dict, repr=False)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+    def encoded(self, encoding: str) -> bytes:
+        variant = self.variants.get(encoding)
+        if variant is None:
+            variant = self.variants[encoding] = compress(self.body, encoding, cached=True)
+        return variant
+
+    def response_headers(self) -> Dict[str, str]:
+        headers = dict(self.headers)
+        if self.etag:
+            headers["ETag"] = self.etag
+        if self.last_modified:
+            headers["Last-Modified"] = self.last_modified
+        return headers
+
+    def not_modified(self, if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+        """Whether the client's validators still match (RFC 9110: If-None-Match wins)."""
+        if if_none_match is not None:
+            if not self.etag:
+                return False
+            tags = [t.strip() for t in if_none_match.split(",")]
+            bare = self.etag.removeprefix("W/")
+            return "*" in tags or any(t.removeprefix("W/") == bare for t in tags)
+        if if_modified_since and self.last_modified:
+            try:
+                return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(self.last_modified)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+class SubscriptionStream:
+    """An upstream response forwarded chunk by chunk, teed into the cache when small enough."""
+
+    def __init__(self, proxy: "SubscriptionProxy", key: Tuple[str, str], response: httpx.Response, waiter: asyncio.Future):
+        self._proxy = proxy
+        self._key = key
+        self._response = response
+        self._waiter = waiter
+        self.status_code = response.status_code
+        self.headers = passthrough_headers(response.headers)
+        # The body hash isn't known before it has streamed, so only an upstream ETag can be sent now;
+        # the cached copy keeps this Last-Modified so revalidation matches either way
+        self.last_modified: Optional[str] = None
+        if self.status_code == 200:
+            self.last_modified = response.headers.get("last-modified") or formatdate(usegmt=True)
+            self.headers["Last-Modified"] = self.last_modified
+            if response.headers.get("etag"):
+                self.headers["ETag"] = response.headers["etag"]
+
+    async def iter_bytes(self) -> AsyncIterator[bytes]:
+        buffer: Optional[List[bytes]] = [] if self.status_code == 200 else None
+        size = 0
+        async for chunk in self._response.aiter_raw():
+            if buffer is not None:
+                size += len(chunk)
+                if size <= self._proxy.max_cached_body:
+                    buffer.append(chunk)
+                else:
+                    buffer = None  # too large to keep: stream only
+            yield chunk
+        document = None
+        if buffer is not None:
+            document = self._proxy._store(self._key, self._response, b"".join(buffer), None, self.last_modified)
+        self._finish(document)
+
+    def _finish(self, document: Optional[SubscriptionDocument]):
+        if not self._waiter.done():
+            self._waiter.set_result(document)
+        if self._proxy._streaming.get(self._key) is self._waiter:
+            del self._proxy._streaming[self._key]
+
+    async def aclose(self):
+        """Always runs after the response (also on client disconnect)."""
+        await self._response.aclose()
+        self._finish(None)
+
+
+class SubscriptionProxy:
+    """Fetches subscription documents from Marzban over a shared connection pool."""
+
+    def __init__(self):
+        # Latency budget for one upstream subscription fetch (SUB_PROXY_TIMEOUT)
+        self.timeout = float(os.getenv("SUB_PROXY_TIMEOUT", "10"))
+        self._client: Optional[httpx.AsyncClient] = None
+        # Fresh for SUB_CACHE_TTL, then served stale (and revalidated) for SUB_CACHE_STALE more
+        self.fresh_ttl = float(os.getenv("SUB_CACHE_TTL", "60"))
+        self.stale_ttl = float(os.getenv("SUB_CACHE_STALE", "600"))
+        self.cache = TTLCache(
+            maxsize=int(os.getenv("SUB_CACHE_SIZE", "5000")),
+            ttl=self.fresh_ttl + self.stale_ttl
+        )
+        self.flight = SingleFlight()
+        # Misses stream the upstream body through; only bodies up to this size are also cached
+        self.streaming = os.getenv("SUB_PROXY_STREAMING", "true").lower() != "false"
+        self.max_cached_body = int(os.getenv("SUB_CACHE_MAX_BODY", str(1024 * 1024)))
+        self._streaming: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._revalidating: set = set()
+        self.revalidations = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily too, in case startup hooks did not run (e.g. tests, scripts)
+        if self._client is None or self._client.is_closed:
+            self._client = build_async_client("SUB_PROXY", timeout=self.timeout)
+        return self._client
+
+    async def start(self):
+        """Open the pool at app startup."""
+        _ = self.client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def node_for(self, token: str) -> MarzbanService:
+        """Node serving this token: its owner's placement, the primary node if the owner is unknown."""
+        # Routing only: a forged token merely reaches the node that rejects it, so decoding is fine here
+        owner = token_index.resolve(token, untrusted=True)
+        if owner is None:
+            return marzban_service
+        # Imported here: nodes -> sub_renderer -> subscription_proxy
+        from app.api.services.nodes import node_registry
+        return await node_registry.service_for(owner.username)
+
+    async def fetch(self, token: str, user_agent: str, headers: Optional[Dict[str, str]] = None,
+                    stream: bool = False) -> httpx.Response:
+        """
+        GET /sub/{token} from the user's node through that node's circuit breaker (raises CircuitOpenError while open).
+        With stream=True the body is not read; the caller must iterate or close the response.
+        """
+        node = await self.node_for(token)
+        # identity: streamed raw bytes are the document itself, so they can be cached as-is
+        request = self.client.build_request("GET", f"{node.base_url}/sub/{token}", headers={
+            "User-Agent": user_agent, "Accept-Encoding": "identity", **(headers or {})
+        })
+
+        async def send() -> httpx.Response:
+            with metrics.track("marzban_sub", "GET /sub/{token}") as call:
+                response = await self.client.send(request, stream=stream)
+                call.error = response.status_code >= 500
+                return response
+
+        return await node.breaker.call(send, is_failure=lambda r: r.status_code >= 500)
+
+    async def get(self, token: str, user_agent: str) -> Union[SubscriptionDocument, SubscriptionStream]:
+        """Cached document when available, otherwise (in streaming mode) a passthrough stream."""
+        key = (token, client_type(user_agent))
+        if not self.streaming or self.cache.get_stale(key) is not None:
+            return await self.get_document(token, user_agent)
+
+        waiter = self._streaming.get(key)
+        if waiter is not None:
+            # Someone is already streaming this document: reuse it once it lands in the cache
+            try:
+                document = await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+            except asyncio.TimeoutError:
+                document = None
+            if document is not None:
+                return document
+
+        # Registered before the upstream call so concurrent misses wait instead of fetching too
+        waiter = asyncio.get_running_loop().create_future()
+        self._streaming.setdefault(key, waiter)
+        try:
+            response = await self.fetch(token, user_agent, stream=True)
+        except BaseException:
+            waiter.set_result(None)
+            if self._streaming.get(key) is waiter:
+                del self._streaming[key]
+            raise
+        if 400 <= response.status_code < 500:
+            self.cache.invalidate(key)
+        return SubscriptionStream(self, key, response, waiter)
+
+    async def get_document(self, token: str, user_agent: str) -> SubscriptionDocument:
+        """Cached document for this token and client type; stale entries are served while refreshing."""
+        key = (token, client_type(user_agent))
+        cached: Optional[SubscriptionDocument] = self.cache.get(key, max_age=self.fresh_ttl)
+        if cached is not None:
+            return cached
+
+        stale: Optional[SubscriptionDocument] = self.cache.get(key)
+        if stale is not None:
+            self._revalidate_in_background(key, user_agent)
+            return stale
+
+        return await self.flight.do(key, lambda: self._load(key, user_agent))
+
+    def peek(self, token: str, user_agent: str) -> Optional[SubscriptionDocument]:
+        """Whatever is cached for this token and client type, however old; never fetches."""
+        return self.cache.get_stale((token, client_type(user_agent)))
+
+    def _revalidate_in_background(self, key: Tuple[str, str], user_agent: str):
+        if key in self._revalidating:
+            return
+        self._revalidating.add(key)
+
+        async def run():
+            try:
+                await self.flight.do(key, lambda: self._load(key, user_agent))
+                self.revalidations += 1
+            except Exception as e:
+                logger.warning(f"Background subscription refresh failed: {e}")
+            finally:
+                self._revalidating.discard(key)
+
+        asyncio.get_running_loop().create_task(run())
+
+    async def _load(self, key: Tuple[str, str], user_agent: str) -> SubscriptionDocument:
+        token = key[0]
+        previous: Optional[SubscriptionDocument] = self.cache.get_stale(key)
+        conditional = {"If-None-Match": previous.etag} if previous is not None and previous.etag else None
+
+        response = await self.fetch(token, user_agent, headers=conditional)
+        if response.status_code == 304 and previous is not None:
+            previous.fetched_at = time.monotonic()
+            self.cache.set(key, previous)
+            return previous
+
+        body = response.content
+        if response.status_code != 200:
+            if 400 <= response.status_code < 500:
+                # Token revoked or user deleted: stop serving the old document
+                self.cache.invalidate(key)
+            return SubscriptionDocument(status_code=response.status_code, body=body, headers=passthrough_headers(response.headers))
+        return self._store(key, response, body, previous)
+
+    def _store(self, key: Tuple[str, str], response: httpx.Response, body: bytes,
+               previous: Optional[SubscriptionDocument], last_modified: Optional[str] = None) -> SubscriptionDocument:
+        """Cache a complete 200 upstream body (`last_modified`: the value already sent with a stream)."""
+        etag = response.headers.get("etag") or f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        if previous is not None and previous.etag == etag:
+            # Same content: keep the original Last-Modified so If-Modified-Since keeps matching
+            last_modified = previous.last_modified
+        elif last_modified is None:
+            last_modified = response.headers.get("last-modified") or formatdate(usegmt=True)
+
+        document = SubscriptionDocument(
+            status_code=200, body=body, headers=passthrough_headers(response.headers),
+            etag=etag, last_modified=last_modified
+        )
+        self.cache.set(key, document)
+        return document
+
+    def invalidate(self, token: str):
+        """Drop every cached client variant of a token (after key regeneration or user deletion)."""
+        for name in CLIENT_TYPES:
+            self.cache.invalidate((token, name))
+
+    def stats(self) -> Dict[str, Any]:
+        """Connection pool occupancy."""
+        return pool_stats(self._client) if self._client is not None else {}
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {**self.cache.stats(), "fresh_ttl": self.fresh_ttl, "stale_ttl": self.stale_ttl,
+                "revalidations": self.revalidations}
+
+
+# Singleton instance
+sub_proxy = SubscriptionProxy()
@@ -0,0 +1,161 @@
+"""
+Token Index - Subscription token -> owner resolution for /sub/{token}.
+Built from Config.subscription_url and the Marzban user listing, kept
+current on create / regenerate / delete. Lookups never leave the process.
+Decoding a token locally (resolve(untrusted=True)) ignores its signature, so
+such owners are only hints and must never be used to write data.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+import base64
+import logging
+
+from sqlalchemy import select
+
+from app.api.db.database import async_session_maker
+from app.api.models import Config, User
+
+logger = logging.getLogger(__name__)
+
+
+def decode_subscription_token(token: str) -> Optional[str]:
+    """
+    Claimed Marzban username of a subscription token: b64url("username,ts") + 10-char signature.
+    The signature is not checked, so anyone can forge a token that decodes to any user.
+    """
+    try:
+        data = token[:-10]
+        data += "=" * (-len(data) % 4)
+        username = base64.urlsafe_b64decode(data).decode().split(",", 1)[0]
+        return username or None
+    except Exception:
+        return None
+
+
+def token_from_url(subscription_url: Optional[str]) -> Optional[str]:
+    """Last path segment of a subscription URL ("https://host/sub/<token>")."""
+    if not subscription_url:
+        return None
+    token = urlsplit(subscription_url).path.rstrip("/").rsplit("/", 1)[-1]
+    return token or None
+
+
+def _telegram_id(username: str) -> Optional[int]:
+    if username.startswith("user_") and username[5:].isdigit():
+        return int(username[5:])
+    return None
+
+
+@dataclass(frozen=True, slots=True)
+class TokenOwner:
+    username: str
+    user_id: Optional[int]  # users.id, None if the username has no local user
+    indexed: bool  # False = only decoded from the (unverified) token itself
+
+
+class TokenIndex:
+    """In-memory token -> username map plus username -> users.id."""
+
+    def __init__(self):
+        self._by_token: Dict[str, str] = {}
+        self._by_username: Dict[str, str] = {}  # current token, to drop it on regenerate
+        self._user_ids: Dict[str, int] = {}
+        self.loaded = False
+        self.decoded = 0
+
+    def add(self, username: str, subscription_url: Optional[str], user_id: Optional[int] = None) -> Optional[str]:
+        """Record the user's current subscription URL; returns the replaced old token, which stops resolving."""
+        if user_id is not None:
+            self._user_ids[username] = user_id
+        token = token_from_url(subscription_url)
+        if token is None:
+            return None
+        old = self._by_username.get(username)
+        self._by_token[token] = username
+        self._by_username[username] = token
+        if old is not None and old != token:
+            self._by_token.pop(old, None)
+            return old
+        return None
+
+    def remove(self, username: str) -> Optional[str]:
+        """User deleted (or about to be recreated with a new token); returns the dropped token."""
+        token = self._by_username.pop(username, None)
+        if token is not None:
+            self._by_token.pop(token, None)
+        return token
+
+    def set_user_id(self, username: str, user_id: int):
+        self._user_ids[username] = user_id
+
+    def resolve(self, token: str, untrusted: bool = False) -> Optional[TokenOwner]:
+        """O(1) owner lookup of indexed tokens; with untrusted=True unknown tokens are decoded instead."""
+        username = self._by_token.get(token)
+        indexed = username is not None
+        if username is None:
+            if not untrusted:
+                return None
+            username = decode_subscription_token(token)
+            if username is None:
+                return None
+            self.decoded += 1
+        return TokenOwner(username, self._user_ids.get(username), indexed)
+
+    async def user_ids(self, session, tokens) -> Dict[str, int]:
+        """token -> users.id for indexed tokens; owners without a known id are looked up in one query and remembered."""
+        found: Dict[str, int] = {}
+        missing: Dict[str, int] = {}  # token -> telegram id
+        for token in tokens:
+            owner = self.resolve(token)
+            if owner is None:
+                continue
+            if owner.user_id is not None:
+                found[token] = owner.user_id
+            else:
+                telegram_id = _telegram_id(owner.username)
+                if telegram_id is not None:
+                    missing[token] = telegram_id
+        if missing:
+            result = await session.execute(
+                select(User.telegram_id, User.id).where(User.telegram_id.in_(set(missing.values())))
+            )
+            by_telegram = dict(result.all())
+            for token, telegram_id in missing.items():
+                if telegram_id in by_telegram:
+                    found[token] = by_telegram[telegram_id]
+                    self._user_ids[f"user_{telegram_id}"] = by_telegram[telegram_id]
+        return found
+
+    async def load(self):
+        """Build the index from the configs table and local users."""
+        try:
+            async with async_session_maker() as session:
+                users = await session.execute(select(User.telegram_id, User.id))
+                user_ids = {f"user_{tid}": uid for tid, uid in users if tid is not None}
+                configs = await session.execute(
+                    select(Config.email, Config.user_id, Config.subscription_url)
+                    .where(Config.is_active == True)  # noqa: E712
+                    .order_by(Config.id)
+                )
+                rows = configs.all()
+            self._user_ids.update(user_ids)
+            for email, user_id, subscription_url in rows:
+                if email:
+                    self.add(email, subscription_url, user_id)
+            self.loaded = True
+            logger.info(f"Token index loaded: {len(self._by_token)} tokens, {len(self._user_ids)} users")
+        except Exception as e:
+            logger.error(f"Failed to load token index: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self.loaded,
+            "tokens": len(self._by_token),
+            "users": len(self._user_ids),
+            "decoded": self.decoded
+        }
+
+
+# Singleton instance
+token_index = TokenIndex()
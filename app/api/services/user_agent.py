@@ -0,0 +1,130 @@
+"""
+User-Agent Parser - One table-driven parser for VPN client User-Agents.
+Patterns are compiled once and results memoized per raw UA string
+(the set of distinct client UAs is small, polls repeat them constantly).
+
+    Happ/3.7.0/ios CFNetwork/3860.300.31 Darwin/25.2.0
+    Happ/1.5.2 (iOS 17.2; iPhone14,3)
+    V2RayTun/3.0 (Android 14; SM-S918B)
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Optional
+import os
+import re
+
+_APP = re.compile(r"^(\w+)/(\d+(?:\.\d+)*)")
+# Whole word only, so "ClashMetaForAndroid/2.10" is not read as Android 2.10
+_IOS_VERSION = re.compile(r"\bios[\s/]*(\d+(?:\.\d+)*)", re.I)
+_ANDROID_VERSION = re.compile(r"\bandroid[\s/]*(\d+(?:\.\d+)*)", re.I)
+_DARWIN = re.compile(r"darwin/(\d+)\.(\d+)", re.I)
+
+# (pattern, OS family, device); first match wins
+_OS_RULES = (
+    (re.compile(r"ipad", re.I), "iOS", "iPad"),
+    (re.compile(r"iphone|ios", re.I), "iOS", "iPhone"),
+    (re.compile(r"android", re.I), "Android", None),
+    (re.compile(r"windows", re.I), "Windows", "PC"),
+    (re.compile(r"mac|darwin", re.I), "macOS", "Mac"),
+    (re.compile(r"linux", re.I), "Linux", "PC"),
+)
+
+_ANDROID_VENDORS = (
+    (re.compile(r"samsung|sm-", re.I), "Samsung"),
+    (re.compile(r"xiaomi|redmi", re.I), "Xiaomi"),
+    (re.compile(r"huawei", re.I), "Huawei"),
+)
+
+# Darwin major version -> iOS major version (approximate)
+_DARWIN_TO_IOS = {"25": "18", "24": "17", "23": "16", "22": "15", "21": "14"}
+
+# Marzban renders a different subscription format per client family
+_CLIENT_TYPES = (
+    ("clash-meta", re.compile(r"^(clash-verge|clash[-.]?meta|flclash|mihomo)", re.I)),
+    ("clash", re.compile(r"^(clash|stash)", re.I)),
+    ("sing-box", re.compile(r"^(sfa|sfi|sfm|sft|karing|hiddifynext|sing-box)", re.I)),
+    ("outline", re.compile(r"^(ss|ssr|ssd|sss|outline|shadowsocks|ssconf)\b", re.I)),
+    ("happ", re.compile(r"^happ/", re.I)),
+    ("v2rayn", re.compile(r"^v2rayng?/", re.I)),
+    ("streisand", re.compile(r"^streisand", re.I)),
+)
+CLIENT_TYPES = tuple(name for name, _ in _CLIENT_TYPES) + ("other",)
+
+
+@dataclass(frozen=True, slots=True)
+class UserAgentInfo:
+    """Parsed User-Agent; shared between callers, so immutable."""
+    raw: str
+    app_name: Optional[str]
+    app_version: Optional[str]
+    os_family: Optional[str]  # iOS, Android, Windows, macOS, Linux
+    os_version: Optional[str]  # version number only, e.g. "17.2"
+    device: Optional[str]  # iPhone, iPad, Samsung, Xiaomi, Huawei, Android Device, PC, Mac
+    client_type: str
+
+    def device_dict(self) -> Dict[str, Any]:
+        """Fields stored for a subscription request (Device model columns)."""
+        if self.os_family == "iOS":
+            device_name, os_version = self.device, f"iOS {self.os_version}" if self.os_version else None
+        elif self.os_family == "Android":
+            device_name, os_version = "Android", f"Android {self.os_version}" if self.os_version else None
+        elif self.os_family == "macOS":
+            device_name, os_version = "Mac", "macOS"
+        elif self.os_family:
+            device_name, os_version = f"{self.os_family} PC", self.os_family
+        else:
+            device_name, os_version = None, None
+        return {
+            "user_agent": self.raw,
+            "device_name": device_name,
+            "os_version": os_version,
+            "app_name": self.app_name,
+            "app_version": self.app_version
+        }
+
+    def summary(self) -> Optional[str]:
+        """Short label for the bot, e.g. "iOS 17.2 — iPhone"."""
+        if not self.raw:
+            return None
+        if self.os_family:
+            os_label = f"{self.os_family} {self.os_version}" if self.os_version else self.os_family
+            return f"{os_label} — {self.device}"
+        return self.raw[:30] + "..." if len(self.raw) > 30 else self.raw
+
+
+@lru_cache(maxsize=int(os.getenv("UA_CACHE_SIZE", "1024")))
+def parse_user_agent(ua: Optional[str]) -> UserAgentInfo:
+    ua = ua or ""
+
+    app_name = app_version = None
+    app = _APP.match(ua)
+    if app:
+        app_name, app_version = app.group(1), app.group(2)
+
+    os_family = device = os_version = None
+    for pattern, family, family_device in _OS_RULES:
+        if pattern.search(ua):
+            os_family, device = family, family_device
+            break
+
+    if os_family == "iOS":
+        version = _IOS_VERSION.search(ua)
+        if version:
+            os_version = version.group(1)
+        else:
+            darwin = _DARWIN.search(ua)
+            if darwin and darwin.group(1) in _DARWIN_TO_IOS:
+                minor = int(darwin.group(2))
+                os_version = f"{_DARWIN_TO_IOS[darwin.group(1)]}.{minor // 100 if minor > 10 else minor}"
+    elif os_family == "Android":
+        version = _ANDROID_VERSION.search(ua)
+        if version:
+            os_version = version.group(1)
+        device = next((vendor for pattern, vendor in _ANDROID_VENDORS if pattern.search(ua)), "Android Device")
+
+    kind = next((name for name, pattern in _CLIENT_TYPES if pattern.match(ua)), "other")
+    return UserAgentInfo(ua, app_name, app_version, os_family, os_version, device, kind)
+
+
+def client_type(ua: Optional[str]) -> str:
+    return parse_user_agent(ua).client_type
@@ -2,7 +2,7 @@ from app.api.models import User
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.api.schemas import UserCreate
-from app.api.services.xray import marzban_service
+from app.api.services.nodes import node_registry
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,14 +22,18 @@ class UserService:
             session.add(db_user)
             await session.commit()
             await session.refresh(db_user)
-        
-        # 2. Create/Sync user in Marzban (Critical Step)
+        # End the read transaction so this session gives its connection back
+        # before the node registry opens its own sessions (and Marzban is called)
+        await session.commit()
+
+        # 2. Create/Sync user in Marzban on their node (Critical Step)
         try:
             # We pass username for descriptive note in Marzban
             username_safe = user.username or "NoUsername"
-            await marzban_service.create_or_update_user(
+            await node_registry.create_user(
                 telegram_id=user.telegram_id,
-                username=username_safe
+                username=username_safe,
+                need_body=False  # /start only needs the user to exist
             )
             logger.info(f"Synced user {user.telegram_id} with Marzban")
         except Exception as e:
@@ -46,13 +50,15 @@ class UserService:
     async def get_user_subscription(self, session: AsyncSession, telegram_id: int):
         """Get real subscription info from Marzban"""
         # We fetch directly from Marzban to get the freshest stats (traffic)
-        marzban_info = await marzban_service.get_subscription_info(telegram_id)
+        service = await node_registry.service_for(f"user_{telegram_id}")
+        marzban_info = await service.get_subscription_info(telegram_id)
         
         if not marzban_info:
             # If not in Marzban, try creating it?
             try:
-                await marzban_service.create_or_update_user(telegram_id)
-                marzban_info = await marzban_service.get_subscription_info(telegram_id)
+                await node_registry.create_user(telegram_id)
+                service = await node_registry.service_for(f"user_{telegram_id}")
+                marzban_info = await service.get_subscription_info(telegram_id)
             except Exception as e:
                 logger.error(f"Could not create missing Marzban user: {e}")
                 return None
@@ -0,0 +1,277 @@
+"""
+User Sync - Local mirror of Marzban users.
+A background loop pulls users page by page and writes only changed rows,
+so admin views can be served from indexed local queries. The same pass keeps
+Config.vless_link in step with the links Marzban currently hands out.
+"""
+from typing import Optional, Dict, Any, List, Tuple
+from datetime import datetime, timezone
+import asyncio
+import logging
+import os
+
+from sqlalchemy import select, func, insert, update, delete, or_
+
+from app.api.db.database import async_session_maker
+from app.api.models import Config, MarzbanUser
+from app.api.services.nodes import node_registry
+from app.api.services.sub_renderer import sub_renderer
+from app.api.services.subscription_proxy import sub_proxy
+from app.api.services.token_index import token_index
+
+logger = logging.getLogger(__name__)
+
+SYNC_FIELDS = ("status", "used_traffic", "data_limit", "expire", "online_at", "note", "sub_last_user_agent", "created_at")
+
+
+def _fingerprint(values: Dict[str, Any]) -> tuple:
+    return tuple(values.get(f) for f in SYNC_FIELDS)
+
+
+def mirror_to_dict(row: MarzbanUser) -> Dict[str, Any]:
+    """Mirror row in the same shape as a Marzban user dict."""
+    data = {f: getattr(row, f) for f in SYNC_FIELDS}
+    data["username"] = row.username
+    return data
+
+
+class UserSyncService:
+    """Keeps the marzban_users table in step with Marzban."""
+
+    def __init__(self):
+        self.interval = float(os.getenv("MARZBAN_SYNC_INTERVAL", "60"))
+        self.page_size = int(os.getenv("MARZBAN_SYNC_PAGE_SIZE", "500"))
+        self.enabled = os.getenv("MARZBAN_SYNC_ENABLED", "true").lower() != "false"
+        # username -> fingerprint of what the mirror currently holds
+        self._fingerprints: Optional[Dict[str, tuple]] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.last_synced_at: Optional[datetime] = None
+        self.last_upserted = 0
+        self.last_deleted = 0
+        self.last_links_updated = 0
+
+    async def _load_fingerprints(self) -> Dict[str, tuple]:
+        cols = [getattr(MarzbanUser, f) for f in SYNC_FIELDS]
+        async with async_session_maker() as session:
+            result = await session.execute(select(MarzbanUser.username, *cols))
+            return {row[0]: tuple(row[1:]) for row in result}
+
+    async def _fetch_all(self) -> Optional[Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]]:
+        """Users of every node trimmed to synced fields plus their links, or None if any page failed."""
+        users: Dict[str, Dict[str, Any]] = {}
+        links: Dict[str, str] = {}
+        await node_registry.ensure_loaded()
+        for service in node_registry.services():
+            offset = 0
+            while True:
+                page = await service.get_users_page(offset, self.page_size)
+                if page.get("error"):
+                    return None
+                for user in page["users"]:
+                    users[user["username"]] = {f: user.get(f) for f in SYNC_FIELDS}
+                    if user.get("links"):
+                        links[user["username"]] = "\n".join(user["links"])
+                    token_index.add(user["username"], user.get("subscription_url"))
+                offset += len(page["users"])
+                if not page["users"] or offset >= page["total"]:
+                    break
+        return users, links
+
+    async def _refresh_links(self, links: Dict[str, str]) -> int:
+        """Rewrite stored links that Marzban now reports differently (host / inbound changes); returns users updated."""
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(Config.email, Config.vless_link).where(Config.is_active == True)  # noqa: E712
+            )
+            stored = dict(result.all())
+            changed = {u: l for u, l in links.items() if u in stored and stored[u] != l}
+            for username, vless_link in changed.items():
+                await session.execute(
+                    update(Config)
+                    .where(Config.email == username, Config.is_active == True)  # noqa: E712
+                    .values(vless_link=vless_link)
+                )
+            if changed:
+                await session.commit()
+        for username in changed:
+            sub_renderer.invalidate(username)
+        return len(changed)
+
+    async def sync_once(self) -> Dict[str, int]:
+        """Pull Marzban users and upsert/delete only what changed."""
+        async with self._lock:
+            if self._fingerprints is None:
+                self._fingerprints = await self._load_fingerprints()
+
+            fetched = await self._fetch_all()
+            if fetched is None:
+                # Never treat a failed fetch as "everyone was deleted"
+                logger.warning("User sync skipped: Marzban listing failed")
+                return {"upserted": 0, "deleted": 0}
+            users, links = fetched
+
+            now = datetime.now(timezone.utc)
+            new_rows: List[Dict[str, Any]] = []
+            changed_rows: List[Dict[str, Any]] = []
+            for username, values in users.items():
+                known = self._fingerprints.get(username)
+                if known == _fingerprint(values):
+                    continue
+                row = {"username": username, "synced_at": now, **values}
+                (new_rows if known is None else changed_rows).append(row)
+            deleted = [u for u in self._fingerprints if u not in users]
+            for username in deleted:
+                token = token_index.remove(username)
+                if token is not None:
+                    sub_proxy.invalidate(token)
+
+            if new_rows or changed_rows or deleted:
+                async with async_session_maker() as session:
+                    if new_rows:
+                        await session.execute(insert(MarzbanUser), new_rows)
+                    if changed_rows:
+                        await session.execute(update(MarzbanUser), changed_rows)
+                    if deleted:
+                        await session.execute(delete(MarzbanUser).where(MarzbanUser.username.in_(deleted)))
+                    await session.commit()
+
+            self._fingerprints = {u: _fingerprint(v) for u, v in users.items()}
+            try:
+                self.last_links_updated = await self._refresh_links(links)
+            except Exception as e:
+                logger.error(f"Failed to refresh stored links: {e}")
+            self.last_synced_at = now
+            self.last_upserted = len(new_rows) + len(changed_rows)
+            self.last_deleted = len(deleted)
+            UserMirror._ready = True
+            if self.last_upserted or self.last_deleted or self.last_links_updated:
+                logger.info(f"User sync: {self.last_upserted} upserted, {self.last_deleted} deleted, "
+                            f"{self.last_links_updated} links updated")
+            return {"upserted": self.last_upserted, "deleted": self.last_deleted}
+
+    async def refresh_user(self, username: str):
+        """Re-read one user from Marzban right after an admin mutation; the row is dropped only on a 404."""
+        service = await node_registry.service_for(username)
+        try:
+            # Not get_user: that returns None (or stale data) on any failure, not just "no such user"
+            user = await service.fetch_user(username)
+        except Exception as e:
+            logger.warning(f"Mirror refresh of {username} skipped, Marzban read failed (next sync reconciles): {e}")
+            return
+        try:
+            async with async_session_maker() as session:
+                if user is None:
+                    await session.execute(delete(MarzbanUser).where(MarzbanUser.username == username))
+                else:
+                    values = {f: user.get(f) for f in SYNC_FIELDS}
+                    values["synced_at"] = datetime.now(timezone.utc)
+                    await session.merge(MarzbanUser(username=username, **values))
+                await session.commit()
+            if self._fingerprints is not None:
+                if user is None:
+                    self._fingerprints.pop(username, None)
+                else:
+                    self._fingerprints[username] = _fingerprint(user)
+        except Exception as e:
+            logger.error(f"Error refreshing mirrored user {username}: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync_once()
+            except Exception as e:
+                logger.error(f"User sync failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start the background sync loop (idempotent)."""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "interval": self.interval,
+            "last_synced_at": self.last_synced_at.isoformat() if self.last_synced_at else None,
+            "mirrored_users": len(self._fingerprints or {}),
+            "last_upserted": self.last_upserted,
+            "last_deleted": self.last_deleted,
+            "last_links_updated": self.last_links_updated
+        }
+
+
+class UserMirror:
+    """Admin reads served from the local mirror, falling back to live Marzban (every node) until it is populated."""
+
+    _ready = False
+
+    @classmethod
+    async def is_ready(cls) -> bool:
+        if cls._ready:
+            return True
+        try:
+            async with async_session_maker() as session:
+                result = await session.execute(select(MarzbanUser.username).limit(1))
+                cls._ready = result.first() is not None
+        except Exception:
+            # Table not created yet (e.g. bot started before the API)
+            return False
+        return cls._ready
+
+    @staticmethod
+    def _filtered(query, status: Optional[str], search: Optional[str]):
+        if status:
+            query = query.where(MarzbanUser.status == status)
+        if search:
+            pattern = f"%{search}%"
+            query = query.where(or_(MarzbanUser.username.ilike(pattern), MarzbanUser.note.ilike(pattern)))
+        return query
+
+    @classmethod
+    async def get_users_page(cls, offset: int = 0, limit: int = 20, status: Optional[str] = None, search: Optional[str] = None) -> Dict[str, Any]:
+        """Same shape as MarzbanService.get_users_page: {"users": [...], "total": N}."""
+        if not await cls.is_ready():
+            return await node_registry.get_users_page(offset, limit, status, search)
+
+        async with async_session_maker() as session:
+            total = await session.scalar(cls._filtered(select(func.count()).select_from(MarzbanUser), status, search))
+            query = cls._filtered(select(MarzbanUser), status, search)
+            query = query.order_by(MarzbanUser.created_at, MarzbanUser.username).offset(offset).limit(limit)
+            rows = (await session.execute(query)).scalars().all()
+        return {"users": [mirror_to_dict(r) for r in rows], "total": total or 0}
+
+    @classmethod
+    async def count_users(cls, status: Optional[str] = None) -> int:
+        if not await cls.is_ready():
+            return await node_registry.count_users(status=status)
+
+        async with async_session_maker() as session:
+            total = await session.scalar(cls._filtered(select(func.count()).select_from(MarzbanUser), status, None))
+        return total or 0
+
+    @classmethod
+    async def total_traffic(cls) -> int:
+        """Sum of used_traffic over all users, in bytes."""
+        if not await cls.is_ready():
+            total = 0
+            async for u in node_registry.iter_users(page_size=500):
+                total += u.get("used_traffic", 0) or 0
+            return total
+
+        async with async_session_maker() as session:
+            total = await session.scalar(select(func.coalesce(func.sum(MarzbanUser.used_traffic), 0)))
+        return int(total or 0)
+
+
+# Singleton instance
+user_sync_service = UserSyncService()
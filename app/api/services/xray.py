@@ -1,64 +1,134 @@
 import httpx
 import os
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator
+
+from app.api.services.cache import TTLCache
+from app.api.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.api.services.http_pool import build_async_client
+from app.api.services.marzban_auth import TokenManager
+from app.api.services.metrics import endpoint_label, metrics
+from app.api.services.singleflight import SingleFlight
+from app.api.services.token_index import token_index
+from app.api.services.user_agent import parse_user_agent
 
 logger = logging.getLogger(__name__)
 
+# Per-call latency budgets (seconds): short for bot UI reads, long for admin writes
+UI_TIMEOUT = float(os.getenv("MARZBAN_UI_TIMEOUT", "5"))
+ADMIN_TIMEOUT = float(os.getenv("MARZBAN_ADMIN_TIMEOUT", "30"))
+# POST first on create and treat 409 as "already exists" instead of GET-then-POST
+OPTIMISTIC_CREATE = os.getenv("MARZBAN_OPTIMISTIC_CREATE", "true").lower() != "false"
+
+def format_server_status(data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Bot-facing health summary of a /api/system payload (None = offline)."""
+    if data is not None:
+        return {
+            "online": True,
+            "online_users": data.get("online_users", 0),
+            "cpu_usage": data.get("cpu_usage", 0),
+            "mem_usage": round(data.get("mem_used", 0) / data.get("mem_total", 1) * 100, 1) if data.get("mem_total") else 0
+        }
+
+    return {"online": False, "online_users": 0, "cpu_usage": 0, "mem_usage": 0}
+
 class MarzbanService:
-    def __init__(self):
-        self.base_url = os.getenv("MARZBAN_URL")
-        self.username = os.getenv("MARZBAN_USERNAME")
-        self.password = os.getenv("MARZBAN_PASSWORD")
-        self.token = None
-        # SSL verification - use env var for self-signed certs in dev
-        verify_ssl = os.getenv("MARZBAN_VERIFY_SSL", "true").lower() != "false"
-        self.client = httpx.AsyncClient(timeout=30.0, verify=verify_ssl)
-
-    async def _authenticate(self):
-        """Get JWT token from Marzban"""
-        try:
-            response = await self.client.post(
-                f"{self.base_url}/api/admin/token",
-                data={"username": self.username, "password": self.password},
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
-            )
-            response.raise_for_status()
-            self.token = response.json().get("access_token")
-            logger.info("Successfully authenticated with Marzban")
-        except Exception as e:
-            logger.error(f"Failed to authenticate with Marzban: {e}")
-            raise
+    def __init__(self, base_url: Optional[str] = None, username: Optional[str] = None, password: Optional[str] = None, name: str = "marzban"):
+        # Defaults describe the primary node from env; extra nodes come from the AppServer table
+        self.name = name
+        self.base_url = (base_url or os.getenv("MARZBAN_URL", "https://instabotwebhook.ru:8000")).rstrip("/")
+        self.username = username or os.getenv("MARZBAN_USERNAME")
+        self.password = password or os.getenv("MARZBAN_PASSWORD")
+        # One pooled keep-alive client for all Marzban traffic in this process
+        self.client = build_async_client("MARZBAN")
+        self.auth = TokenManager(self.client, self.base_url, self.username, self.password)
+        # Short-lived cache for get_user: the same user is often fetched several times in a few seconds
+        self.user_cache = TTLCache(
+            maxsize=int(os.getenv("MARZBAN_USER_CACHE_SIZE", "2048")),
+            ttl=float(os.getenv("MARZBAN_USER_CACHE_TTL", "10"))
+        )
+        # Usernames recently seen to exist, so repeat /start skips Marzban entirely
+        self.confirmed_users = TTLCache(
+            maxsize=int(os.getenv("MARZBAN_CONFIRMED_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("MARZBAN_CONFIRMED_CACHE_TTL", "3600"))
+        )
+        # Concurrent identical reads share one upstream request
+        self.flight = SingleFlight()
+        # Fail fast (or serve stale cache) while Marzban is down or slow
+        self.breaker = CircuitBreaker(name, prefix="MARZBAN")
 
     async def _get_headers(self) -> Dict[str, str]:
-        if not self.token:
-            await self._authenticate()
-        return {"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"}
+        token = await self.auth.get_token()
+        return self.auth.headers(token)
+
+    async def _request(self, method: str, path: str, timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+        """
+        Authorized request to Marzban with one transparent retry on 401.
+        `timeout` is the per-call latency budget; raises CircuitOpenError while the circuit is open.
+        """
+        url = f"{self.base_url}{path}"
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        async def send() -> httpx.Response:
+            with metrics.track(self.name, endpoint_label(method, path)) as call:
+                response = await self.auth.request(method, url, **kwargs)
+                call.error = response.status_code >= 500
+                return response
+
+        return await self.breaker.call(send, is_failure=lambda r: r.status_code >= 500)
+
+    async def close(self):
+        """Release pooled connections and stop background token refresh."""
+        await self.auth.close()
+        await self.client.aclose()
+
+    def invalidate_user(self, username: str):
+        """Drop cached user data after a mutation."""
+        self.user_cache.invalidate(username)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """User cache hit/miss counters."""
+        return self.user_cache.stats()
 
-    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+    def breaker_stats(self) -> Dict[str, Any]:
+        """Circuit breaker state."""
+        return self.breaker.stats()
+
+    async def get_user(self, username: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        cached = self.user_cache.get(username)
+        if cached is not None:
+            return cached
+        return await self.flight.do(("user", username), lambda: self._fetch_user(username, timeout))
+
+    async def fetch_user(self, username: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Fresh GET: None only if Marzban says 404; any other failure raises."""
+        response = await self._request("GET", f"/api/user/{username}", timeout=timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        user = response.json()
+        self.user_cache.set(username, user)
+        return user
+
+    async def _fetch_user(self, username: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
         try:
-            headers = await self._get_headers()
-            response = await self.client.get(f"{self.base_url}/api/user/{username}", headers=headers)
-            
-            if response.status_code == 404:
-                return None
-            
-            if response.status_code == 401: # Token expired
-                await self._authenticate()
-                headers = await self._get_headers()
-                response = await self.client.get(f"{self.base_url}/api/user/{username}", headers=headers)
-            
-            response.raise_for_status()
-            return response.json()
+            return await self.fetch_user(username, timeout)
         except Exception as e:
-            logger.error(f"Error fetching user {username}: {e}")
-            return None
+            stale = self.user_cache.get_stale(username)
+            if isinstance(e, CircuitOpenError):
+                logger.warning(f"Marzban unavailable, {'serving stale' if stale else 'no cached'} user {username}: {e}")
+            else:
+                logger.error(f"Error fetching user {username}: {e}")
+            return stale
 
     async def get_all_users(self) -> list:
         """Get all users from Marzban for admin panel."""
+        return await self.flight.do("users", self._fetch_all_users)
+
+    async def _fetch_all_users(self) -> list:
         try:
-            headers = await self._get_headers()
-            response = await self.client.get(f"{self.base_url}/api/users", headers=headers)
+            response = await self._request("GET", "/api/users")
             if response.status_code == 200:
                 data = response.json()
                 return data.get("users", [])
@@ -67,11 +137,76 @@ class MarzbanService:
             logger.error(f"Error fetching all users: {e}")
             return []
 
-    async def delete_user(self, username: str) -> bool:
+    async def get_users_page(self, offset: int = 0, limit: int = 20, status: Optional[str] = None, search: Optional[str] = None) -> Dict[str, Any]:
+        """One page of users via Marzban's offset/limit/filter params: {"users": [...], "total": N}."""
+        params = {"offset": offset, "limit": limit}
+        if status:
+            params["status"] = status
+        if search:
+            params["search"] = search
+        key = ("users_page", offset, limit, status, search)
+        return await self.flight.do(key, lambda: self._fetch_users_page(params))
+
+    async def _fetch_users_page(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = await self._request("GET", "/api/users", params=params)
+            if response.status_code == 200:
+                data = response.json()
+                return {"users": data.get("users", []), "total": data.get("total", 0)}
+            logger.error(f"Failed to fetch users page {params}: {response.status_code}")
+        except Exception as e:
+            logger.error(f"Error fetching users page {params}: {e}")
+        # `error` lets callers tell a failed fetch from an empty result
+        return {"users": [], "total": 0, "error": True}
+
+    async def iter_users(self, page_size: int = 100, status: Optional[str] = None, search: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield users page by page instead of loading the whole listing."""
+        offset = 0
+        while True:
+            page = await self.get_users_page(offset, page_size, status, search)
+            users = page["users"]
+            for user in users:
+                yield user
+            offset += len(users)
+            if not users or len(users) < page_size or offset >= page["total"]:
+                break
+
+    async def count_users(self, status: Optional[str] = None, search: Optional[str] = None) -> int:
+        """Total matching users; fetches a single row to read Marzban's `total`."""
+        page = await self.get_users_page(0, 1, status, search)
+        return page["total"]
+
+    async def modify_user(self, username: str, changes: Dict[str, Any], timeout: Optional[float] = ADMIN_TIMEOUT) -> bool:
+        """PUT partial changes to a Marzban user."""
+        return await self.update_user(username, changes, timeout=timeout) is not None
+
+    async def update_user(self, username: str, changes: Dict[str, Any], timeout: Optional[float] = ADMIN_TIMEOUT) -> Optional[Dict[str, Any]]:
+        """PUT partial changes and return the updated user (which also becomes the cached state)."""
+        try:
+            response = await self._request("PUT", f"/api/user/{username}", timeout=timeout, json=changes)
+            self.invalidate_user(username)
+            if response.status_code == 200:
+                user = response.json()
+                self.user_cache.set(username, user)
+                return user
+            logger.error(f"Failed to modify user {username}: {response.status_code}")
+            return None
+        except Exception as e:
+            logger.error(f"Error modifying user {username}: {e}")
+            return None
+
+    async def delete_user(self, username: str, timeout: Optional[float] = None) -> bool:
         """Delete a user from Marzban."""
         try:
-            headers = await self._get_headers()
-            response = await self.client.delete(f"{self.base_url}/api/user/{username}", headers=headers)
+            response = await self._request("DELETE", f"/api/user/{username}", timeout=timeout)
+            self.invalidate_user(username)
+            self.confirmed_users.invalidate(username)
+            if response.status_code in (200, 404):
+                token = token_index.remove(username)
+                if token is not None:
+                    # Imported here: subscription_proxy builds on this module
+                    from app.api.services.subscription_proxy import sub_proxy
+                    sub_proxy.invalidate(token)
             if response.status_code == 200:
                 logger.info(f"Deleted user {username}")
                 return True
@@ -85,18 +220,29 @@ class MarzbanService:
             logger.error(f"Error deleting user {username}: {e}")
             return False
 
-    async def create_or_update_user(self, telegram_id: int, username: str = "User") -> Dict[str, Any]:
-        """Create a user in Marzban, or return existing one if found."""
+    async def create_or_update_user(self, telegram_id: int, username: str = "User", timeout: Optional[float] = None,
+                                    need_body: bool = True) -> Dict[str, Any]:
+        """
+        Create a user in Marzban, or return existing one if found.
+        In optimistic mode the POST goes first and "already exists" (409) counts as success;
+        with need_body=False a recently confirmed user returns just {"username": ...} without any Marzban call.
+        """
         marzban_username = f"user_{telegram_id}"
-        
-        # Check if exists
-        existing_user = await self.get_user(marzban_username)
-        if existing_user:
-            logger.info(f"User {marzban_username} already exists in Marzban.")
-            return existing_user
 
-        headers = await self._get_headers()
-        
+        if not OPTIMISTIC_CREATE:
+            existing_user = await self.get_user(marzban_username, timeout=timeout)
+            if existing_user:
+                logger.info(f"User {marzban_username} already exists in Marzban.")
+                return existing_user
+        elif self.confirmed_users.get(marzban_username):
+            if not need_body:
+                return {"username": marzban_username}
+            existing_user = await self.get_user(marzban_username, timeout=timeout)
+            if existing_user:
+                return existing_user
+            # Deleted behind our back: create it again
+            self.confirmed_users.invalidate(marzban_username)
+
         # 300 GB = 300 * 1024^3 bytes = 322122547200 bytes
         TRAFFIC_LIMIT_300GB = 300 * (1024 ** 3)
         
@@ -119,14 +265,22 @@ class MarzbanService:
         }
         
         try:
-            response = await self.client.post(
-                f"{self.base_url}/api/user",
-                json=payload,
-                headers=headers
-            )
+            response = await self._request("POST", "/api/user", timeout=timeout, json=payload)
+            if response.status_code == 409:
+                logger.info(f"User {marzban_username} already exists in Marzban.")
+                self.confirmed_users.set(marzban_username, True)
+                if not need_body:
+                    return {"username": marzban_username}
+                existing_user = await self.get_user(marzban_username, timeout=timeout)
+                if existing_user is None:
+                    raise RuntimeError(f"User {marzban_username} exists but could not be fetched")
+                return existing_user
             response.raise_for_status()
             logger.info(f"Created new user {marzban_username} in Marzban.")
-            return response.json()
+            user = response.json()
+            self.user_cache.set(marzban_username, user)
+            self.confirmed_users.set(marzban_username, True)
+            return user
         except httpx.HTTPStatusError as e:
             logger.error(f"HTTP error creating user: {e.response.text}")
             raise
@@ -134,32 +288,33 @@ class MarzbanService:
             logger.error(f"General error creating user: {e}")
             raise
 
-    async def get_server_status(self) -> Dict[str, Any]:
-        """Check Marzban server health status."""
+    async def get_system(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Raw /api/system payload, or None if Marzban is unreachable."""
+        return await self.flight.do("system", lambda: self._fetch_system(timeout))
+
+    async def _fetch_system(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
         try:
-            headers = await self._get_headers()
-            response = await self.client.get(f"{self.base_url}/api/system", headers=headers)
+            response = await self._request("GET", "/api/system", timeout=timeout)
             if response.status_code == 200:
-                data = response.json()
-                return {
-                    "online": True,
-                    "online_users": data.get("online_users", 0),
-                    "cpu_usage": data.get("cpu_usage", 0),
-                    "mem_usage": round(data.get("mem_used", 0) / data.get("mem_total", 1) * 100, 1) if data.get("mem_total") else 0
-                }
+                return response.json()
+        except CircuitOpenError as e:
+            logger.warning(f"Skipping server status check: {e}")
         except Exception as e:
             logger.error(f"Error checking server status: {e}")
-        
-        return {"online": False, "online_users": 0, "cpu_usage": 0, "mem_usage": 0}
+        return None
+
+    async def get_server_status(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Check Marzban server health status."""
+        return format_server_status(await self.get_system(timeout=timeout))
 
-    async def get_subscription_info(self, telegram_id: int) -> Dict[str, Any]:
+    async def get_subscription_info(self, telegram_id: int, timeout: Optional[float] = None) -> Dict[str, Any]:
         """Get formatted subscription info for the bot"""
-        user = await self.get_user(f"user_{telegram_id}")
+        user = await self.get_user(f"user_{telegram_id}", timeout=timeout)
         if not user:
             return None
         
         # Parse device info from User-Agent
-        device_info = self._parse_user_agent(user.get("sub_last_user_agent", ""))
+        device_info = parse_user_agent(user.get("sub_last_user_agent")).summary()
         
         # Get original subscription URL from Marzban
         original_sub_url = user.get("subscription_url", "")
@@ -185,66 +340,6 @@ class MarzbanService:
             "last_device": device_info,
             "online_at": user.get("online_at", None)
         }
-    
-    def _parse_user_agent(self, ua: str) -> str:
-        """Parse User-Agent string to extract device info."""
-        if not ua:
-            return None
-        
-        import re
-        
-        # Common patterns for VPN clients
-        # Happ/1.5.2 (iOS 17.2; iPhone14,3)
-        # V2RayTun/3.0 (Android 14; SM-S918B)
-        # Shadowrocket/2.2.0 (iOS; iPhone)
-        
-        ua_lower = ua.lower()
-        
-        # Detect OS
-        if "ios" in ua_lower or "iphone" in ua_lower or "ipad" in ua_lower:
-            os_name = "iOS"
-            # Try to extract version
-            ios_match = re.search(r'ios[\s/]*([\d.]+)', ua_lower)
-            if ios_match:
-                os_name = f"iOS {ios_match.group(1)}"
-            
-            # Detect device type
-            if "ipad" in ua_lower:
-                device = "iPad"
-            else:
-                device = "iPhone"
-            
-            return f"{os_name} — {device}"
-        
-        elif "android" in ua_lower:
-            os_name = "Android"
-            android_match = re.search(r'android[\s/]*([\d.]+)', ua_lower)
-            if android_match:
-                os_name = f"Android {android_match.group(1)}"
-            
-            # Try to detect device model
-            if "samsung" in ua_lower or "sm-" in ua_lower:
-                device = "Samsung"
-            elif "xiaomi" in ua_lower or "redmi" in ua_lower:
-                device = "Xiaomi"
-            elif "huawei" in ua_lower:
-                device = "Huawei"
-            else:
-                device = "Android Device"
-            
-            return f"{os_name} — {device}"
-        
-        elif "windows" in ua_lower:
-            return "Windows — PC"
-        
-        elif "mac" in ua_lower or "darwin" in ua_lower:
-            return "macOS — Mac"
-        
-        elif "linux" in ua_lower:
-            return "Linux — PC"
-        
-        # Generic fallback
-        return ua[:30] + "..." if len(ua) > 30 else ua
 
 # Singleton instance
 marzban_service = MarzbanService()
@@ -9,7 +9,6 @@ from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-import os
 import logging
 from datetime import datetime, timedelta
 
@@ -88,14 +87,12 @@ async def admin_stats(callback: CallbackQuery):
         # Get server status
         server = await api.get_server_status()
         
-        # Get all users from Marzban via direct call
-        from app.api.services.xray import marzban_service
-        users = await marzban_service.get_all_users()
-        
-        total_users = len(users) if users else 0
-        active_users = sum(1 for u in users if u.get("status") == "active") if users else 0
-        disabled_users = sum(1 for u in users if u.get("status") == "disabled") if users else 0
-        total_traffic = sum(u.get("used_traffic", 0) for u in users) if users else 0
+        # Get user counts from the local Marzban mirror
+        from app.api.services.user_sync import UserMirror
+        total_users = await UserMirror.count_users()
+        active_users = await UserMirror.count_users(status="active")
+        disabled_users = await UserMirror.count_users(status="disabled")
+        total_traffic = await UserMirror.total_traffic()
         total_traffic_gb = round(total_traffic / (1024**3), 2)
         
         online_users = server.get("online_users", 0) if server.get("online") else 0
@@ -140,10 +137,13 @@ async def admin_users(callback: CallbackQuery):
     per_page = 8
     
     try:
-        from app.api.services.xray import marzban_service
-        users = await marzban_service.get_all_users()
+        from app.api.services.user_sync import UserMirror
+        # Only the requested page is read from the local mirror
+        result = await UserMirror.get_users_page(offset=page * per_page, limit=per_page)
+        page_users = result["users"]
+        total = result["total"]
         
-        if not users:
+        if not total:
             text = "👥 Пользователей нет"
             await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="⬅️ Меню", callback_data="admin:menu")]
@@ -151,11 +151,7 @@ async def admin_users(callback: CallbackQuery):
             return
         
         # Pagination
-        total = len(users)
         total_pages = (total + per_page - 1) // per_page
-        start = page * per_page
-        end = start + per_page
-        page_users = users[start:end]
         
         text = f"👥 <b>Пользователи</b> ({page + 1}/{total_pages})\n\nНажмите для управления:"
         
@@ -205,8 +201,10 @@ async def user_detail(callback: CallbackQuery):
     
     username = callback.data.split(":")[1]
     
-    from app.api.services.xray import marzban_service
-    user = await marzban_service.get_user(username)
+    from app.api.services.nodes import node_registry
+    from app.api.services.xray import UI_TIMEOUT
+    marzban_service = await node_registry.service_for(username)
+    user = await marzban_service.get_user(username, timeout=UI_TIMEOUT)
     
     if not user:
         await callback.answer(f"❌ Пользователь не найден", show_alert=True)
@@ -413,33 +411,15 @@ async def add_traffic(callback: CallbackQuery, state: FSMContext):
     username = parts[3]
     
     try:
-        from app.api.services.xray import marzban_service
-        
-        # Get current user
-        user = await marzban_service.get_user(username)
-        if not user:
-            await callback.answer("❌ Пользователь не найден", show_alert=True)
-            return
-        
-        # Calculate new limit
-        current_limit = user.get("data_limit", 0)
-        add_bytes = gb * (1024 ** 3)
-        new_limit = current_limit + add_bytes
+        from app.api.services.mutations import mutation_service
         
-        # Update via Marzban API
-        import httpx
-        async with httpx.AsyncClient(verify=os.getenv("MARZBAN_VERIFY_SSL", "true").lower() != "false", timeout=30) as client:
-            headers = await marzban_service._get_headers()
-            resp = await client.put(
-                f"{marzban_service.base_url}/api/user/{username}",
-                headers=headers,
-                json={"data_limit": new_limit}
-            )
-            
-            if resp.status_code == 200:
-                await callback.answer(f"✅ Добавлено {gb} ГБ!", show_alert=True)
-            else:
-                await callback.answer("❌ Ошибка добавления трафика", show_alert=True)
+        # Serialised per user, so concurrent admin actions don't overwrite each other
+        if await mutation_service.add_traffic(username, gb):
+            from app.api.services.user_sync import user_sync_service
+            await user_sync_service.refresh_user(username)
+            await callback.answer(f"✅ Добавлено {gb} ГБ!", show_alert=True)
+        else:
+            await callback.answer("❌ Ошибка добавления трафика", show_alert=True)
                 
     except Exception as e:
         await callback.answer(f"❌ {e}", show_alert=True)
@@ -202,16 +202,22 @@ async def regenerate_key_handler(callback: CallbackQuery):
     await callback.message.edit_text("⏳ <b>Перегенерация ключа...</b>\n\nПожалуйста, подождите.", parse_mode="HTML")
     
     try:
-        from app.api.services.xray import marzban_service
+        from app.api.services.nodes import node_registry
         from app.bot.utils.crypto import encrypt_vless_link
         
         marzban_username = f"user_{telegram_id}"
         
+        # Recreate on the node the user already lives on
+        marzban_service = await node_registry.service_for(marzban_username)
+        server_id = await node_registry.server_id_for(marzban_username)
+        
         # Delete existing user
         await marzban_service.delete_user(marzban_username)
         
         # Create new user
         result = await marzban_service.create_or_update_user(telegram_id, username)
+        if result:
+            await node_registry.record_placement(telegram_id, server_id, result)
         
         if result:
             await callback.answer("✅ Ключ перегенерирован!", show_alert=True)
@@ -1,11 +1,11 @@
 import asyncio
-import logging
 import os
 from aiogram import Bot, Dispatcher
 from app.bot.handlers import start, admin
 
 async def main():
-    logging.basicConfig(level=logging.INFO)
+    from app.api.services.logging_setup import setup_logging
+    setup_logging()
     
     bot_token = os.getenv("BOT_TOKEN")
     if not bot_token:
@@ -13,6 +13,9 @@ async def main():
         return
 
     bot = Bot(token=bot_token)
+    # Time Telegram API calls next to Marzban/Happ ones
+    from app.bot.utils.metrics import TelegramMetricsMiddleware, start_metrics_server
+    bot.session.middleware(TelegramMetricsMiddleware())
     dp = Dispatcher()
     
     dp.include_router(start.router)
@@ -30,7 +33,23 @@ async def main():
     
     print("🤖 Bot is starting...")
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+
+    # Server badge in key views reads the poller snapshot
+    from app.api.services.status_poller import status_poller
+    status_poller.start()
+
+    metrics_port = int(os.getenv("BOT_METRICS_PORT", "9101") or 0)
+    metrics_runner = await start_metrics_server(metrics_port) if metrics_port else None
+    try:
+        await dp.start_polling(bot)
+    finally:
+        from app.api.services.nodes import node_registry
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await status_poller.stop()
+        await node_registry.close()
+        from app.api.services.logging_setup import stop_logging
+        stop_logging()
 
 if __name__ == "__main__":
     asyncio.run(main())
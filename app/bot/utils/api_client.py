@@ -18,10 +18,16 @@ class APIClient:
         pass
 
     async def create_user(self, telegram_id: int, username: str, full_name: str):
-        """Create user via Marzban directly."""
+        """Create user in the DB and on their Marzban node."""
         try:
-            from app.api.services.xray import marzban_service
-            return await marzban_service.create_or_update_user(telegram_id, username)
+            from app.api.db.database import async_session_maker
+            from app.api.schemas import UserCreate
+            from app.api.services.user_service import UserService
+            async with async_session_maker() as session:
+                return await UserService().create_user(
+                    session,
+                    UserCreate(telegram_id=telegram_id, username=username, full_name=full_name)
+                )
         except Exception as e:
             logger.error(f"create_user error: {e}")
             return None
@@ -29,9 +35,11 @@ class APIClient:
     async def get_user(self, telegram_id: int):
         """Get user from Marzban directly."""
         try:
-            from app.api.services.xray import marzban_service
+            from app.api.services.nodes import node_registry
+            from app.api.services.xray import UI_TIMEOUT
             username = f"user_{telegram_id}"
-            return await marzban_service.get_user(username)
+            service = await node_registry.service_for(username)
+            return await service.get_user(username, timeout=UI_TIMEOUT)
         except Exception as e:
             logger.error(f"get_user error: {e}")
             return None
@@ -39,9 +47,11 @@ class APIClient:
     async def get_subscription(self, telegram_id: int):
         """Get subscription data from Marzban directly."""
         try:
-            from app.api.services.xray import marzban_service
+            from app.api.services.nodes import node_registry
+            from app.api.services.xray import UI_TIMEOUT
             username = f"user_{telegram_id}"
-            user = await marzban_service.get_user(username)
+            service = await node_registry.service_for(username)
+            user = await service.get_user(username, timeout=UI_TIMEOUT)
             if user:
                 return {
                     "subscription_url": user.get("subscription_url"),
@@ -61,10 +71,10 @@ class APIClient:
         return None
 
     async def get_server_status(self):
-        """Get server status from Marzban directly."""
+        """Get server status from the shared background poller."""
         try:
-            from app.api.services.xray import marzban_service
-            return await marzban_service.get_server_status()
+            from app.api.services.status_poller import status_poller
+            return (await status_poller.snapshot()).server_status()
         except Exception as e:
             logger.error(f"get_server_status error: {e}")
             return {"online": False}
@@ -4,10 +4,13 @@ Uses https://crypto.happ.su/api.php to encrypt vless:// links into happ://crypt4
 """
 import aiohttp
 import logging
+import os
+
+from app.api.services.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
-HAPP_CRYPTO_API = "https://crypto.happ.su/api.php"
+HAPP_CRYPTO_API = os.getenv("HAPP_CRYPTO_API", "https://crypto.happ.su/api.php")
 
 async def encrypt_vless_link(vless_url: str, name: str = "🤎MomsVPN") -> str:
     """
@@ -18,20 +21,23 @@ async def encrypt_vless_link(vless_url: str, name: str = "🤎MomsVPN") -> str:
     If encryption fails, returns the original link.
     """
     try:
-        async with aiohttp.ClientSession() as session:
-            # Use original URL format (custom name investigation in progress)
-            payload = {"url": vless_url}
-            async with session.post(HAPP_CRYPTO_API, json=payload, timeout=10) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    encrypted = data.get("encrypted_link")
-                    if encrypted:
-                        logger.info("Successfully encrypted link via Happ API")
-                        return encrypted
+        with metrics.track("happ", "POST /api.php") as call:
+            async with aiohttp.ClientSession() as session:
+                # Use original URL format (custom name investigation in progress)
+                payload = {"url": vless_url}
+                async with session.post(HAPP_CRYPTO_API, json=payload, timeout=10) as resp:
+                    if resp.status == 200:
+                        data = await resp.json()
+                        encrypted = data.get("encrypted_link")
+                        if encrypted:
+                            logger.info("Successfully encrypted link via Happ API")
+                            return encrypted
+                        else:
+                            logger.warning(f"Happ API returned no encrypted_link: {data}")
                     else:
-                        logger.warning(f"Happ API returned no encrypted_link: {data}")
-                else:
-                    logger.warning(f"Happ API returned status {resp.status}")
+                        logger.warning(f"Happ API returned status {resp.status}")
+                    # Falling back to the plain link counts as a failed call
+                    call.error = True
     except Exception as e:
         logger.error(f"Failed to encrypt via Happ API: {e}")
     
@@ -0,0 +1,36 @@
+"""
+Bot metrics - Times Telegram Bot API calls and serves /metrics for the bot process.
+Shares the registry in app.api.services.metrics with Marzban and Happ calls.
+"""
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+import logging
+
+from app.api.services.metrics import metrics, CONTENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Records every outgoing Bot API request (sendMessage, editMessageText, ...)."""
+
+    async def __call__(self, make_request, bot, method):
+        # getUpdates is long polling: its latency is idle time, not a slow reply
+        if method.__api_method__ == "getUpdates":
+            return await make_request(bot, method)
+        with metrics.track("telegram", method.__api_method__):
+            return await make_request(bot, method)
+
+
+async def start_metrics_server(port: int, host: str = "0.0.0.0") -> web.AppRunner:
+    """Serve GET /metrics on a small aiohttp server next to polling."""
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=metrics.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Bot metrics on http://{host}:{port}/metrics")
+    return runner
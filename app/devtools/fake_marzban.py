@@ -0,0 +1,235 @@
+"""
+Fake Marzban - Self-contained stand-in for the Marzban API (and Happ crypto API).
+For local runs and benchmarks: configurable latency, error injection and user fixtures.
+
+    python -m app.devtools.fake_marzban          # uvicorn on FAKE_MARZBAN_PORT (default 8800)
+
+or in-process:
+
+    async with FakeMarzban(users=10_000).serve(port=8800) as fake: ...
+"""
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+SUB_SECRET = "fake-marzban-secret"
+GB = 1024 ** 3
+
+
+def subscription_token(username: str, created_at: Optional[float] = None) -> str:
+    """Token in Marzban's format: b64(username,ts) + 10-char signature."""
+    data = f"{username},{math.ceil(created_at or time.time())}"
+    data_b64 = base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+    sign = base64.urlsafe_b64encode(hashlib.sha256((data_b64 + SUB_SECRET).encode()).digest()).decode().rstrip("=")
+    return data_b64 + sign[:10]
+
+
+class FakeMarzban:
+    """In-memory Marzban with the subset of endpoints this project uses."""
+
+    def __init__(self, users: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, token_ttl: float = 86400, seed: int = 42):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.random = random.Random(seed)
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.tokens: Dict[str, str] = {}  # subscription token -> username
+        self.requests = 0
+        for i in range(users):
+            self.add_user(f"user_{100000 + i}", status="active" if i % 10 else "disabled",
+                          used_traffic=self.random.randint(0, 300) * GB // 10)
+        self.app = self._build_app()
+
+    def add_user(self, username: str, **fields) -> Dict[str, Any]:
+        created_at = time.time() - self.random.randint(0, 90 * 86400)
+        token = subscription_token(username, created_at)
+        user = {
+            "username": username,
+            "status": "active",
+            "used_traffic": 0,
+            "lifetime_used_traffic": 0,
+            "data_limit": 300 * GB,
+            "expire": 0,
+            "note": "",
+            "online_at": None,
+            "sub_updated_at": None,
+            "sub_last_user_agent": None,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(created_at)),
+            "proxies": {"vless": {"id": str(uuid.UUID(int=self.random.getrandbits(128))), "flow": ""}},
+            "inbounds": {"vless": ["VLESS_TCP_REALITY", "VLESS_WS_TLS"]},
+            "links": [],
+            "subscription_url": f"/sub/{token}",
+        }
+        user.update(fields)
+        user["links"] = [f"vless://{user['proxies']['vless']['id']}@127.0.0.1:443?security=reality&type=tcp#{username}"]
+        self.users[username] = user
+        self.tokens[token] = username
+        return user
+
+    async def _delay(self):
+        self.requests += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise HTTPException(status_code=500, detail="Injected error")
+
+    def _issue_token(self) -> str:
+        header = base64.urlsafe_b64encode(b'{"alg":"none"}').decode().rstrip("=")
+        payload = base64.urlsafe_b64encode(json.dumps({"sub": "admin", "exp": int(time.time() + self.token_ttl)}).encode()).decode().rstrip("=")
+        return f"{header}.{payload}.fake"
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title="Fake Marzban", docs_url=None, redoc_url=None)
+
+        @app.middleware("http")
+        async def check_auth(request: Request, call_next):
+            path = request.url.path
+            if path.startswith("/api/") and path != "/api/admin/token":
+                if not request.headers.get("authorization", "").startswith("Bearer "):
+                    return JSONResponse({"detail": "Not authenticated"}, status_code=401)
+            return await call_next(request)
+
+        @app.post("/api/admin/token")
+        async def token(username: str = Form(...), password: str = Form(...)):
+            await self._delay()
+            return {"access_token": self._issue_token(), "token_type": "bearer"}
+
+        @app.get("/api/user/{username}")
+        async def get_user(username: str):
+            await self._delay()
+            if username not in self.users:
+                raise HTTPException(status_code=404, detail="User not found")
+            return self.users[username]
+
+        @app.post("/api/user")
+        async def create_user(request: Request):
+            await self._delay()
+            body = await request.json()
+            if body["username"] in self.users:
+                raise HTTPException(status_code=409, detail="User already exists")
+            fields = {k: v for k, v in body.items() if k in ("status", "expire", "data_limit", "note", "inbounds")}
+            return self.add_user(body["username"], **fields)
+
+        @app.put("/api/user/{username}")
+        async def modify_user(username: str, request: Request):
+            await self._delay()
+            if username not in self.users:
+                raise HTTPException(status_code=404, detail="User not found")
+            body = await request.json()
+            self.users[username].update({k: v for k, v in body.items() if k != "username"})
+            return self.users[username]
+
+        @app.delete("/api/user/{username}")
+        async def delete_user(username: str):
+            await self._delay()
+            user = self.users.pop(username, None)
+            if user is None:
+                raise HTTPException(status_code=404, detail="User not found")
+            self.tokens.pop(user["subscription_url"].rsplit("/", 1)[-1], None)
+            return {}
+
+        @app.post("/api/user/{username}/reset")
+        async def reset_user(username: str):
+            await self._delay()
+            if username not in self.users:
+                raise HTTPException(status_code=404, detail="User not found")
+            self.users[username]["used_traffic"] = 0
+            return self.users[username]
+
+        @app.get("/api/users")
+        async def list_users(offset: int = 0, limit: Optional[int] = None,
+                             status: Optional[str] = None, search: Optional[str] = None):
+            await self._delay()
+            users: List[Dict[str, Any]] = list(self.users.values())
+            if status:
+                users = [u for u in users if u["status"] == status]
+            if search:
+                users = [u for u in users if search in u["username"] or search in (u["note"] or "")]
+            page = users[offset:offset + limit] if limit is not None else users[offset:]
+            return {"users": page, "total": len(users)}
+
+        @app.get("/api/system")
+        async def system():
+            await self._delay()
+            active = sum(1 for u in self.users.values() if u["status"] == "active")
+            return {
+                "version": "0.8.4-fake",
+                "mem_total": 8 * GB,
+                "mem_used": 3 * GB,
+                "cpu_cores": 4,
+                "cpu_usage": round(self.random.uniform(5, 40), 1),
+                "total_user": len(self.users),
+                "users_active": active,
+                "online_users": active // 10,
+                "uptime": int(time.monotonic()),
+            }
+
+        @app.get("/sub/{token}")
+        async def subscription(token: str, request: Request):
+            await self._delay()
+            username = self.tokens.get(token)
+            if username is None:
+                raise HTTPException(status_code=404, detail="Not Found")
+            user = self.users[username]
+            user["sub_last_user_agent"] = request.headers.get("user-agent")
+            user["sub_updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+            body = base64.b64encode("\n".join(user["links"]).encode()).decode()
+            return PlainTextResponse(body, headers={
+                "subscription-userinfo": f"upload=0; download={user['used_traffic']}; total={user['data_limit'] or 0}; expire={user['expire'] or 0}",
+                "profile-update-interval": "12",
+                "profile-title": "base64:" + base64.b64encode(b"MomsVPN").decode(),
+            })
+
+        @app.post("/happ/api.php")
+        async def happ_encrypt(request: Request):
+            # Stand-in for crypto.happ.su (point HAPP_CRYPTO_API here)
+            await self._delay()
+            body = await request.json()
+            return {"encrypted_link": "happ://crypt4/" + base64.urlsafe_b64encode(body["url"].encode()).decode()}
+
+        return app
+
+    @asynccontextmanager
+    async def serve(self, host: str = "127.0.0.1", port: int = 8800):
+        """Run under uvicorn inside the current event loop."""
+        import uvicorn
+
+        server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning", lifespan="off"))
+        task = asyncio.get_running_loop().create_task(server.serve())
+        while not server.started:
+            if task.done():
+                task.result()
+            await asyncio.sleep(0.01)
+        try:
+            yield self
+        finally:
+            server.should_exit = True
+            await task
+
+
+def from_env() -> FakeMarzban:
+    return FakeMarzban(
+        users=int(os.getenv("FAKE_MARZBAN_USERS", "1000")),
+        latency=float(os.getenv("FAKE_MARZBAN_LATENCY", "0.02")),
+        jitter=float(os.getenv("FAKE_MARZBAN_JITTER", "0.01")),
+        error_rate=float(os.getenv("FAKE_MARZBAN_ERROR_RATE", "0")),
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(from_env().app, host="0.0.0.0", port=int(os.getenv("FAKE_MARZBAN_PORT", "8800")))
@@ -0,0 +1,69 @@
+"""
+Benchmark helpers - Closed-loop load generator and latency percentiles.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List
+import asyncio
+import time
+
+
+@dataclass
+class Result:
+    name: str
+    concurrency: int
+    latencies: List[float] = field(default_factory=list)  # seconds, successful and failed calls
+    errors: int = 0
+    elapsed: float = 0.0
+    upstream_requests: int = 0  # calls that reached the fake Marzban
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, Any]:
+        count = len(self.latencies)
+        return {
+            "name": self.name,
+            "requests": count,
+            "errors": self.errors,
+            "concurrency": self.concurrency,
+            "throughput": round(count / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p95_ms": round(self.percentile(95) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+        }
+
+
+async def run_load(name: str, fn: Callable[[int], Awaitable[bool]], requests: int, concurrency: int) -> Result:
+    """Call fn(i) `requests` times from `concurrency` workers; fn returns False (or raises) on error."""
+    result = Result(name=name, concurrency=concurrency)
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                ok = await fn(i)
+            except Exception:
+                ok = False
+            result.latencies.append(time.perf_counter() - start)
+            if not ok:
+                result.errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def print_report(results: List[Result]):
+    header = f"{'scenario':<28} {'reqs':>7} {'errs':>6} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        s = r.summary()
+        print(f"{s['name']:<28} {s['requests']:>7} {s['errors']:>6} {s['concurrency']:>5} {s['throughput']:>9} "
+              f"{s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9}")
@@ -0,0 +1,223 @@
+"""
+End-to-end load benchmark against the fake Marzban.
+
+    python -m benchmarks.run                              # all scenarios
+    python -m benchmarks.run -s sub,bot_my_keys -n 5000 -c 100 --latency 0.05
+    python -m benchmarks.run --json results.json          # keep numbers for regression diffs
+
+Runs the API, admin panel and bot handlers in-process against app.devtools.fake_marzban
+(served over loopback HTTP) with a throwaway SQLite DB, and reports throughput and p50/p95/p99.
+"""
+from contextvars import ContextVar
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure_env(port: int):
+    """Must run before any app module is imported (settings are read at import time)."""
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="momsvpn-bench-"))  # SQLite file lands here
+    os.environ["POSTGRES_USER"] = ""
+    os.environ["MARZBAN_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["MARZBAN_USERNAME"] = "admin"
+    os.environ["MARZBAN_PASSWORD"] = "admin"
+    os.environ["HAPP_CRYPTO_API"] = f"http://127.0.0.1:{port}/happ/api.php"
+    os.environ.setdefault("ADMIN_PANEL_USERNAME", "admin")
+    os.environ.setdefault("ADMIN_PANEL_PASSWORD", "bench")
+    # One loopback client would trip the per-IP /sub limiter
+    os.environ["SUB_RATE_LIMIT_ENABLED"] = "false"
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+
+class _StubMessage:
+    """Just enough of aiogram's Message for the handlers under test (no Telegram calls)."""
+
+    async def answer(self, *args, **kwargs):
+        return None
+
+    async def edit_text(self, *args, **kwargs):
+        return None
+
+    async def delete(self, *args, **kwargs):
+        return None
+
+
+# Error records logged by the bot handler call running in the current task
+_handler_errors: ContextVar[Optional[List[logging.LogRecord]]] = ContextVar("handler_errors", default=None)
+
+
+class _ErrorCollector(logging.Handler):
+    """Root handler attributing ERROR records to the bot handler call that logged them."""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+
+    def emit(self, record: logging.LogRecord):
+        errors = _handler_errors.get()
+        if errors is not None:
+            errors.append(record)
+
+
+def _stub_update(telegram_id: int) -> SimpleNamespace:
+    user = SimpleNamespace(id=telegram_id, username=f"bench{telegram_id}", first_name="Bench", full_name="Bench User")
+    message = _StubMessage()
+    message.from_user = user
+
+    async def answer(*args, **kwargs):
+        return None
+
+    return SimpleNamespace(from_user=user, message=message, answer=answer)
+
+
+async def seed_db(fake) -> List[int]:
+    """Users and Config rows matching the fake's fixtures; returns their Telegram ids."""
+    from sqlalchemy import insert, select
+
+    from app.api.db.database import Base, async_session_maker, engine
+    from app.api.models import Config, User
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    telegram_ids = [int(name.split("_", 1)[1]) for name in fake.users]
+    async with async_session_maker() as session:
+        await session.execute(insert(User), [{"telegram_id": tid, "username": f"bench{tid}"} for tid in telegram_ids])
+        ids = dict((await session.execute(select(User.telegram_id, User.id))).all())
+        await session.execute(insert(Config), [
+            {
+                "user_id": ids[tid],
+                "email": f"user_{tid}",
+                "uuid": fake.users[f"user_{tid}"]["proxies"]["vless"]["id"],
+                "subscription_url": fake.users[f"user_{tid}"]["subscription_url"],
+                "vless_link": "\n".join(fake.users[f"user_{tid}"]["links"]),
+                "is_active": True,
+            }
+            for tid in telegram_ids
+        ])
+        await session.commit()
+    return telegram_ids
+
+
+def build_scenarios(fake, telegram_ids: List[int]) -> Dict[str, Callable[[int], Awaitable[bool]]]:
+    import httpx
+
+    from app.admin.main import app as admin_app
+    from app.api.main import app as api_app
+    from app.bot.handlers import start as start_handlers
+
+    api = httpx.AsyncClient(transport=httpx.ASGITransport(app=api_app), base_url="http://api")
+    basic = base64.b64encode(f"{os.environ['ADMIN_PANEL_USERNAME']}:{os.environ['ADMIN_PANEL_PASSWORD']}".encode()).decode()
+    admin = httpx.AsyncClient(transport=httpx.ASGITransport(app=admin_app), base_url="http://admin",
+                              headers={"Authorization": f"Basic {basic}"})
+    tokens = [u["subscription_url"].rsplit("/", 1)[-1] for u in fake.users.values()]
+
+    def pick(seq, i):
+        return seq[random.Random(i).randrange(len(seq))]
+
+    async def get(client, url, headers=None) -> bool:
+        response = await client.get(url, headers=headers)
+        return response.status_code == 200
+
+    async def bot(handler, i) -> bool:
+        # Handlers catch their own exceptions and log them, so a logged error counts as a failed call
+        errors: List[logging.LogRecord] = []
+        token = _handler_errors.set(errors)
+        try:
+            await handler(_stub_update(pick(telegram_ids, i)))
+        finally:
+            _handler_errors.reset(token)
+        return not errors
+
+    happ_ua = {"User-Agent": "Happ/3.7.0/ios CFNetwork/3860.300.31 Darwin/25.2.0"}
+    return {
+        "sub": lambda i: get(api, f"/sub/{pick(tokens, i)}", happ_ua),
+        "sub_local": lambda i: get(api, f"/sub/{pick(tokens, i)}", happ_ua),
+        "user_subscription": lambda i: get(api, f"/users/{pick(telegram_ids, i)}/subscription"),
+        "admin_dashboard": lambda i: get(admin, "/admin/dashboard"),
+        "admin_users": lambda i: get(admin, f"/admin/users?page={i % 5 + 1}"),
+        "admin_keys": lambda i: get(admin, f"/admin/keys?page={i % 5 + 1}"),
+        "admin_server_status": lambda i: get(admin, "/admin/api/servers/status"),
+        "bot_start": lambda i: bot(start_handlers.command_start, i),
+        "bot_profile": lambda i: bot(start_handlers.profile_handler, i),
+        "bot_my_keys": lambda i: bot(start_handlers.my_keys, i),
+    }
+
+
+async def main(args):
+    configure_env(args.port)
+    logging.basicConfig(level=logging.ERROR)
+
+    from app.devtools.fake_marzban import FakeMarzban
+    from benchmarks.common import print_report, run_load
+
+    fake = FakeMarzban(users=args.users, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    async with fake.serve(port=args.port):
+        from app.api.db.database import engine
+        engine.sync_engine.echo = False
+
+        telegram_ids = await seed_db(fake)
+        from app.api.main import app as api_app
+        await api_app.router.startup()
+        # After startup: setup_logging replaces the root handlers
+        logging.getLogger().addHandler(_ErrorCollector())
+        # Local rendering reads usage from the user mirror
+        from app.api.services.user_sync import user_sync_service
+        await user_sync_service.sync_once()
+        from app.api.services.sub_renderer import sub_renderer
+
+        scenarios = build_scenarios(fake, telegram_ids)
+        selected = args.scenarios.split(",") if args.scenarios else list(scenarios)
+        unknown = [s for s in selected if s not in scenarios]
+        if unknown:
+            raise SystemExit(f"Unknown scenario(s): {', '.join(unknown)}; choose from {', '.join(scenarios)}")
+
+        results = []
+        for name in selected:
+            # Same endpoint either way: "sub" proxies Marzban, "sub_local" renders locally
+            sub_renderer.enabled = name == "sub_local"
+            # Short warm-up so pools, tokens and caches are in their steady state
+            await run_load(name, scenarios[name], min(50, args.requests), args.concurrency)
+            upstream_before = fake.requests
+            result = await run_load(name, scenarios[name], args.requests, args.concurrency)
+            result.upstream_requests = fake.requests - upstream_before
+            results.append(result)
+
+        await api_app.router.shutdown()
+
+    print(f"\nfake Marzban: {args.users} users, latency {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} ms, "
+          f"error rate {args.error_rate:.1%}\n")
+    print_report(results)
+    print("\nupstream requests per call: " + ", ".join(
+        f"{r.name}={r.upstream_requests / max(len(r.latencies), 1):.2f}" for r in results))
+    if args.json:
+        with open(os.path.join(REPO_ROOT, args.json) if not os.path.isabs(args.json) else args.json, "w") as f:
+            json.dump([{**r.summary(), "upstream_requests": r.upstream_requests} for r in results], f, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-s", "--scenarios", help="comma-separated subset (default: all)")
+    parser.add_argument("-n", "--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("-c", "--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=1000, help="fake Marzban user fixtures")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake Marzban mean latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.01, help="+/- latency jitter (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake Marzban calls failing with 500")
+    parser.add_argument("--port", type=int, default=8811, help="loopback port for the fake Marzban")
+    parser.add_argument("--json", help="also write the summary to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,44 @@
+"""
+Micro-benchmark for app.api.services.user_agent.
+
+    python -m benchmarks.user_agent
+
+Compares the memoized parser (steady state: a small set of UAs repeating)
+with the uncached parse, and prints ns per call.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.api.services.user_agent import parse_user_agent  # noqa: E402
+
+# Roughly what subscription polls look like: a handful of client builds
+USER_AGENTS = [
+    "Happ/3.7.0/ios CFNetwork/3860.300.31 Darwin/25.2.0",
+    "Happ/1.5.2 (iOS 17.2; iPhone14,3)",
+    "Happ/3.5.1/android",
+    "V2RayTun/3.0 (Android 14; SM-S918B)",
+    "v2rayNG/1.8.19",
+    "Streisand/2.3 CFNetwork/1494.0.7 Darwin/23.4.0",
+    "clash-verge/v1.7.7",
+    "SFA/1.9.3 (Android 13; Redmi Note 12)",
+    "Shadowrocket/2.2.0 (iOS; iPad)",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+]
+
+
+def bench(fn, number: int = 200_000) -> float:
+    calls = [USER_AGENTS[i % len(USER_AGENTS)] for i in range(number)]
+    elapsed = min(timeit.repeat(lambda: [fn(ua) for ua in calls], number=1, repeat=5))
+    return elapsed / number * 1e9
+
+
+if __name__ == "__main__":
+    uncached = parse_user_agent.__wrapped__
+    print(f"{'parser':<24} {'ns/call':>10}")
+    print(f"{'uncached':<24} {bench(uncached):>10.0f}")
+    print(f"{'memoized (lru_cache)':<24} {bench(parse_user_agent):>10.0f}")
+    print(f"{'memoized + device_dict':<24} {bench(lambda ua: parse_user_agent(ua).device_dict()):>10.0f}")
+    print(parse_user_agent.cache_info())
@@ -0,0 +1,75 @@
+"""
+Half-open transitions are decided by the probe only, not by late calls from before the circuit opened.
+"""
+import asyncio
+
+import pytest
+
+from app.api.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setenv("TEST_BREAKER_MIN_CALLS", "2")
+    monkeypatch.setenv("TEST_BREAKER_FAILURE_RATIO", "0.5")
+    monkeypatch.setenv("TEST_BREAKER_OPEN_SECONDS", "0")
+    return CircuitBreaker("test", prefix="TEST")
+
+
+def test_opens_after_failure_ratio(breaker):
+    breaker.record(False, 0.0)
+    assert breaker._state == CLOSED
+    breaker.record(False, 0.0)
+    assert breaker._state == OPEN
+
+
+def test_only_one_probe_is_let_through(breaker):
+    breaker._open()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert breaker.allow() is None
+
+
+def test_late_call_from_closed_state_does_not_decide_the_probe(breaker):
+    async def run():
+        release_slow = asyncio.Event()
+        release_probe = asyncio.Event()
+
+        async def slow():
+            await release_slow.wait()
+            return "late"
+
+        async def probe():
+            await release_probe.wait()
+            raise ConnectionError("still down")
+
+        # Started while closed, finishes after the circuit has gone half-open
+        late = asyncio.ensure_future(breaker.call(slow))
+        await asyncio.sleep(0)
+        breaker._open()
+        assert breaker.state == HALF_OPEN
+
+        probing = asyncio.ensure_future(breaker.call(probe))
+        await asyncio.sleep(0)
+        release_slow.set()
+        assert await late == "late"
+        # The late success neither closed the circuit nor freed the probe slot
+        assert breaker._state == HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(slow)
+
+        release_probe.set()
+        with pytest.raises(ConnectionError):
+            await probing
+        assert breaker._state == OPEN
+
+    asyncio.run(run())
+
+
+def test_successful_probe_closes(breaker):
+    async def ok():
+        return 200
+
+    breaker._open()
+    assert asyncio.run(breaker.call(ok)) == 200
+    assert breaker._state == CLOSED
@@ -0,0 +1,56 @@
+"""
+Queued extend deltas are merged into one write, and a caller cancelled while waiting is not applied.
+"""
+from types import SimpleNamespace
+import asyncio
+
+import pytest
+
+from app.api.services.mutations import MutationService
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """MutationService whose writes are recorded instead of sent; each write waits for `release`."""
+    mutations = MutationService()
+    writes = []
+    release = asyncio.Event()
+
+    async def write(username, batch):
+        await release.wait()
+        writes.append((username, batch.days, batch.contributors))
+        return True
+
+    monkeypatch.setattr(mutations, "_write", write)
+    return SimpleNamespace(extend=mutations.extend, writes=writes, release=release)
+
+
+def test_queued_deltas_are_coalesced(service):
+    async def run():
+        first = asyncio.ensure_future(service.extend("user_1", 1))
+        await asyncio.sleep(0)  # first holds the lock and is writing
+        queued = [asyncio.ensure_future(service.extend("user_1", 7)) for _ in range(3)]
+        await asyncio.sleep(0)
+        service.release.set()
+        return await asyncio.gather(first, *queued)
+
+    assert asyncio.run(run()) == [True] * 4
+    assert service.writes == [("user_1", 1, 1), ("user_1", 21, 3)]
+
+
+def test_cancelled_waiter_delta_is_not_written(service):
+    async def run():
+        first = asyncio.ensure_future(service.extend("user_1", 1))
+        await asyncio.sleep(0)
+        kept = asyncio.ensure_future(service.extend("user_1", 7))
+        cancelled = asyncio.ensure_future(service.extend("user_1", 30))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        service.release.set()
+        return await asyncio.gather(first, kept, cancelled, return_exceptions=True)
+
+    first, kept, cancelled = asyncio.run(run())
+    assert first is True and kept is True
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert service.writes == [("user_1", 1, 1), ("user_1", 7, 1)]
@@ -0,0 +1,97 @@
+"""
+Token buckets refill, burst and evict idle keys; /sub requests spend only when they fit both buckets.
+"""
+import pytest
+
+from app.api.services import rate_limit
+from app.api.services.rate_limit import SubRateLimiter, TokenBucketLimiter, TrustedProxies
+
+
+def take(limiter, key, now):
+    """One request through `limiter` at `now`: the wait, spending a token when allowed."""
+    wait = limiter.retry_after(key, now)
+    if not wait:
+        limiter.consume(key)
+    return wait
+
+
+def test_burst_then_refill():
+    limiter = TokenBucketLimiter(rate=2, burst=3)
+
+    assert [take(limiter, "a", 0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert take(limiter, "a", 0.0) == pytest.approx(0.5)
+    # Half a second at 2/s is one token
+    assert take(limiter, "a", 0.5) == 0.0
+    assert take(limiter, "a", 0.5) == pytest.approx(0.5)
+    # Refill is capped at the burst size
+    assert [take(limiter, "a", 100.0) for _ in range(4)][-1] == pytest.approx(0.5)
+
+
+def test_keys_have_separate_buckets():
+    limiter = TokenBucketLimiter(rate=1, burst=1)
+
+    assert take(limiter, "a", 0.0) == 0.0
+    assert take(limiter, "a", 0.0) > 0
+    assert take(limiter, "b", 0.0) == 0.0
+
+
+def test_idle_buckets_are_evicted():
+    limiter = TokenBucketLimiter(rate=1, burst=2)
+    take(limiter, "idle", 0.0)
+    take(limiter, "busy", 1.0)
+
+    # `idle` has been untouched for idle_ttl (burst / rate) and would be full again
+    take(limiter, "new", 2.0)
+    assert "idle" not in limiter._buckets
+    assert list(limiter._buckets) == ["busy", "new"]
+
+
+def test_oldest_bucket_is_evicted_past_maxsize():
+    limiter = TokenBucketLimiter(rate=1, burst=10, maxsize=2)
+    for now, key in enumerate(["a", "b", "c"]):
+        take(limiter, key, float(now))
+
+    assert list(limiter._buckets) == ["b", "c"]
+
+
+@pytest.fixture
+def sub_limiter(monkeypatch):
+    """SubRateLimiter with 1-request buckets that never refill, on a frozen clock."""
+    monkeypatch.setenv("SUB_RATE_LIMIT_ENABLED", "true")
+    monkeypatch.setenv("SUB_RATE_TOKEN_RATE", "0.001")
+    monkeypatch.setenv("SUB_RATE_TOKEN_BURST", "1")
+    monkeypatch.setenv("SUB_RATE_IP_RATE", "0.001")
+    monkeypatch.setenv("SUB_RATE_IP_BURST", "1")
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: 1000.0)
+    return SubRateLimiter()
+
+
+def test_request_must_fit_both_buckets_before_spending(sub_limiter):
+    assert sub_limiter.check("token_a", "10.0.0.1") == 0.0
+
+    # Same IP, other token: the IP bucket is empty, so token_b's bucket is left untouched
+    assert sub_limiter.check("token_b", "10.0.0.1") > 0
+    assert sub_limiter.per_ip.limited == 1 and sub_limiter.per_token.limited == 0
+    assert sub_limiter.check("token_b", "10.0.0.2") == 0.0
+
+    # Same token, other IP: the token bucket is empty, so 10.0.0.3 keeps its request
+    assert sub_limiter.check("token_a", "10.0.0.3") > 0
+    assert sub_limiter.check("token_c", "10.0.0.3") == 0.0
+
+
+@pytest.mark.parametrize("spec, peer, forwarded_for, expected", [
+    # No trusted proxies: the header is ignored
+    ("", "203.0.113.9", "198.51.100.1", "203.0.113.9"),
+    # Untrusted peer cannot set the client address
+    ("10.0.0.0/8", "203.0.113.9", "198.51.100.1", "203.0.113.9"),
+    ("10.0.0.0/8", "10.0.0.2", "198.51.100.1", "198.51.100.1"),
+    # Walk from the right past trusted hops; a spoofed left-most entry is not reached
+    ("10.0.0.0/8", "10.0.0.2", "1.2.3.4, 198.51.100.1, 10.0.0.5", "198.51.100.1"),
+    # Every hop trusted: the left-most one
+    ("10.0.0.0/8", "10.0.0.2", "10.1.1.1, 10.0.0.5", "10.1.1.1"),
+    ("10.0.0.0/8", "10.0.0.2", None, "10.0.0.2"),
+    ("*", "203.0.113.9", "198.51.100.1, 192.0.2.7", "198.51.100.1"),
+    ("::1, 127.0.0.1", "::1", "2001:db8::1", "2001:db8::1"),
+])
+def test_trusted_proxies_client_ip(spec, peer, forwarded_for, expected):
+    assert TrustedProxies(spec).client_ip(peer, forwarded_for) == expected
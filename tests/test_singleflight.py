@@ -0,0 +1,53 @@
+"""
+Concurrent get_user calls for the same user share one upstream GET.
+Run with: python -m pytest -q tests
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.api.services.xray import marzban_service
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Route marzban_service through a mock Marzban that answers slowly and counts user GETs."""
+    calls = {"get_user": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/api/admin/token":
+            return httpx.Response(200, json={"access_token": "test-token"})
+        if request.method == "GET" and request.url.path.startswith("/api/user/"):
+            calls["get_user"] += 1
+            # Keep the request in flight long enough for every caller to join it
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"username": request.url.path.rsplit("/", 1)[-1], "status": "active"})
+        return httpx.Response(404)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(marzban_service, "client", client)
+    monkeypatch.setattr(marzban_service.auth, "client", client)
+    marzban_service.user_cache.clear()
+    yield calls
+    marzban_service.user_cache.clear()
+
+
+def test_concurrent_get_user_makes_one_upstream_request(upstream):
+    async def run():
+        return await asyncio.gather(*(marzban_service.get_user("user_42") for _ in range(20)))
+
+    results = asyncio.run(run())
+
+    assert upstream["get_user"] == 1
+    assert all(user == {"username": "user_42", "status": "active"} for user in results)
+
+
+def test_different_users_are_not_coalesced(upstream):
+    async def run():
+        return await asyncio.gather(*(marzban_service.get_user(f"user_{i % 3}") for i in range(12)))
+
+    results = asyncio.run(run())
+
+    assert upstream["get_user"] == 3
+    assert {user["username"] for user in results} == {"user_0", "user_1", "user_2"}
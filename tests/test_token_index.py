@@ -0,0 +1,72 @@
+"""
+A token that only decodes to a username (forged or unknown) resolves to nobody and is never attributed to a user.
+"""
+import asyncio
+import base64
+
+import pytest
+
+from app.api.services import device_tracker as device_tracker_module
+from app.api.services.device_tracker import DeviceTracker, _Sighting
+from app.api.services.token_index import TokenIndex, decode_subscription_token
+from app.api.services.user_agent import parse_user_agent
+
+INDEXED = base64.urlsafe_b64encode(b"user_5,1700000000").decode().rstrip("=") + "sig0123456"
+FORGED = base64.urlsafe_b64encode(b"user_777,1").decode().rstrip("=") + "AAAAAAAAAA"
+
+
+class StubSession:
+    """async_session_maker() stand-in that fails on any query."""
+
+    async def execute(self, statement, *args):
+        raise AssertionError(f"unexpected query: {statement}")
+
+    async def commit(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def index(monkeypatch):
+    """Fresh TokenIndex with one indexed token, swapped in for the device tracker."""
+    index = TokenIndex()
+    index.add("user_5", f"https://sub.example.com/sub/{INDEXED}", user_id=5)
+    # The forged token's claimed owner is a real, known user
+    index.set_user_id("user_777", 777)
+    monkeypatch.setattr(device_tracker_module, "token_index", index)
+    return index
+
+
+def test_unindexed_token_resolves_to_none_by_default(index):
+    assert decode_subscription_token(FORGED) == "user_777"
+    assert index.resolve(FORGED) is None
+
+    owner = index.resolve(FORGED, untrusted=True)
+    assert owner.username == "user_777" and not owner.indexed
+    assert index.resolve(INDEXED).indexed
+
+
+def test_user_ids_ignores_unindexed_tokens(index):
+    session = StubSession()
+
+    assert asyncio.run(index.user_ids(session, {INDEXED, FORGED})) == {INDEXED: 5}
+
+
+def test_device_tracker_never_attributes_unindexed_tokens(index, monkeypatch):
+    session = StubSession()
+    monkeypatch.setattr(device_tracker_module, "async_session_maker", lambda: session)
+    tracker = DeviceTracker()
+    tracker.enabled = True
+    ua = parse_user_agent("Happ/1.5.2 (iOS 17.2; iPhone14,3)")
+
+    tracker.record(FORGED, ua, "203.0.113.9")
+    assert tracker.stats()["pending"] == 0
+
+    # Even if one reaches the buffer, the flush does not write it
+    tracker._pending[(FORGED, ua.raw)] = _Sighting(FORGED, ua, "203.0.113.9", None)
+    assert asyncio.run(tracker.flush()) == 0
@@ -0,0 +1,71 @@
+"""
+parse_user_agent on real client User-Agents: stored device fields, bot label and the /sub cache key.
+"""
+import pytest
+
+from app.api.services.user_agent import CLIENT_TYPES, client_type, parse_user_agent
+
+CASES = [
+    # ua, client_type, summary, device_name, os_version, app_name, app_version
+    ("Happ/1.5.2 (iOS 17.2; iPhone14,3)",
+     "happ", "iOS 17.2 — iPhone", "iPhone", "iOS 17.2", "Happ", "1.5.2"),
+    # No iOS version in the UA: derived from the Darwin kernel version
+    ("Happ/3.7.0/ios CFNetwork/3860.300.31 Darwin/25.2.0",
+     "happ", "iOS 18.2 — iPhone", "iPhone", "iOS 18.2", "Happ", "3.7.0"),
+    ("Happ/1.9.0 (iPad; iOS 17.4)",
+     "happ", "iOS 17.4 — iPad", "iPad", "iOS 17.4", "Happ", "1.9.0"),
+    ("V2RayTun/3.0 (Android 14; SM-S918B)",
+     "other", "Android 14 — Samsung", "Android", "Android 14", "V2RayTun", "3.0"),
+    ("v2rayNG/1.8.19 (Android 13; Redmi Note 12)",
+     "v2rayn", "Android 13 — Xiaomi", "Android", "Android 13", "v2rayNG", "1.8.19"),
+    ("Streisand/1.6.1 (iOS 17.2; iPhone15,2)",
+     "streisand", "iOS 17.2 — iPhone", "iPhone", "iOS 17.2", "Streisand", "1.6.1"),
+    # "Android" inside the app name is not an OS version
+    ("ClashMetaForAndroid/2.10.1.Meta",
+     "clash-meta", "Android — Android Device", "Android", None, "ClashMetaForAndroid", "2.10.1"),
+    ("clash-verge/v1.7.7",
+     "clash-meta", "clash-verge/v1.7.7", None, None, None, None),
+    ("Stash/2.5 (iOS 17)",
+     "clash", "iOS 17 — iPhone", "iPhone", "iOS 17", "Stash", "2.5"),
+    ("SFA/1.8.0 (Android 14)",
+     "sing-box", "Android 14 — Android Device", "Android", "Android 14", "SFA", "1.8.0"),
+    ("SFI/1.8 (iOS 17.1)",
+     "sing-box", "iOS 17.1 — iPhone", "iPhone", "iOS 17.1", "SFI", "1.8"),
+    ("sing-box 1.9.0",
+     "sing-box", "sing-box 1.9.0", None, None, None, None),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+     "other", "Windows — PC", "Windows PC", "Windows", "Mozilla", "5.0"),
+]
+
+
+@pytest.mark.parametrize("ua, kind, summary, device_name, os_version, app_name, app_version", CASES)
+def test_parse_user_agent(ua, kind, summary, device_name, os_version, app_name, app_version):
+    info = parse_user_agent(ua)
+
+    assert info.client_type == kind
+    assert client_type(ua) == kind
+    assert info.summary() == summary
+    assert info.device_dict() == {
+        "user_agent": ua,
+        "device_name": device_name,
+        "os_version": os_version,
+        "app_name": app_name,
+        "app_version": app_version
+    }
+
+
+def test_every_client_type_is_a_known_cache_key():
+    assert {kind for _, kind, *_ in CASES} <= set(CLIENT_TYPES)
+
+
+@pytest.mark.parametrize("ua", [None, ""])
+def test_missing_user_agent(ua):
+    info = parse_user_agent(ua)
+
+    assert info.client_type == "other"
+    assert info.summary() is None
+    assert info.device_dict()["device_name"] is None
+
+
+def test_long_unknown_user_agent_is_truncated():
+    assert parse_user_agent("x" * 40).summary() == "x" * 30 + "..."